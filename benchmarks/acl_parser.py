@@ -0,0 +1,88 @@
+"""
+Cisco ACL output parsing speed: configurator.acl_parser against the old regexp + IPv4Network loop.
+
+    python -m benchmarks.acl_parser --lines 100000
+"""
+import argparse
+import random
+import re
+import time
+from ipaddress import IPv4Network
+
+from configurator.acl_parser import ACTION_PERMIT, parse_cisco_acl
+
+
+def generate_acl(lines: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    output = ['Extended IP access list TO-OG']
+    for i in range(1, lines):
+        ip = f'{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}'
+        kind = rnd.random()
+        if kind < 0.7:
+            entry = f'permit ip any host {ip}.{rnd.randint(1, 254)}'
+        elif kind < 0.95:
+            entry = f'permit ip any {ip}.0 0.0.0.255'
+        else:
+            entry = 'remark resources'
+        if rnd.random() < 0.5:
+            entry += f' ({rnd.randint(1, 100000)} matches)'
+        output.append(f'    {i * 10} {entry}')
+    output.append(f'    {lines * 10} deny ip any any')
+    return '\n'.join(output)
+
+
+def legacy_parse(data: str) -> set:
+    result = set()
+    host_regexp = r'\d+\.\d+\.\d+\.\d+'
+    for line in data.splitlines():
+        if 'permit' in line:
+            ip_mask = re.findall(host_regexp, line)
+            if len(ip_mask) > 1:
+                network = IPv4Network(f'{ip_mask[0]}/{ip_mask[1]}')
+                result.add(f'{ip_mask[0]}/{network.prefixlen}')
+            else:
+                result.add(''.join(ip_mask))
+    return result
+
+
+def parse(data: str) -> set:
+    return {
+        entry.address
+        for entry in parse_cisco_acl(data.splitlines())
+        if entry.action == ACTION_PERMIT and entry.address
+    }
+
+
+def measure(func, data: str, repeat: int) -> (float, set):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(data)
+        duration = time.perf_counter() - started
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = generate_acl(args.lines)
+
+    legacy_time, legacy_result = measure(legacy_parse, data, args.repeat)
+    new_time, new_result = measure(parse, data, args.repeat)
+
+    if legacy_result != new_result:
+        raise SystemExit('Parsers returned different addresses')
+
+    print(f'{args.lines} lines, best of {args.repeat}')
+    print(f'{"legacy":<10} {legacy_time:>8.3f}s {args.lines / legacy_time:>12,.0f} lines/s')
+    print(f'{"parser":<10} {new_time:>8.3f}s {args.lines / new_time:>12,.0f} lines/s')
+    print(f'speedup {legacy_time / new_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
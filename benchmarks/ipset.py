@@ -0,0 +1,82 @@
+"""
+Diff of two IP lists: configurator.ipset.IPSet against sets of strings.
+
+    python -m benchmarks.ipset --entries 100000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from configurator.ipset import IPSet
+
+
+def generate_ips(entries: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    ips = []
+    for _ in range(entries):
+        network = f'{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}'
+        if rnd.random() < 0.9:
+            ips.append(f'{network}.{rnd.randint(1, 254)}')
+        else:
+            ips.append(f'{network}.0/24')
+    return ips
+
+
+def measure(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        duration = time.perf_counter() - started
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def memory(func) -> int:
+    tracemalloc.start()
+    value = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del value
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--changed', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    resolved = generate_ips(args.entries)
+    # The same list as read back from a device: some entries are gone, some are new, hosts may have /32
+    current = [f'{ip}/32' if '/' not in ip else ip for ip in resolved[args.changed:]]
+    current.extend(generate_ips(args.changed, seed=1))
+
+    resolved_strings, current_strings = set(resolved), set(current)
+    resolved_set, current_set = IPSet(resolved), IPSet(current)
+
+    def diff_strings():
+        return resolved_strings - current_strings, current_strings - resolved_strings
+
+    def diff_ipset():
+        return resolved_set - current_set, current_set - resolved_set
+
+    strings_to_add, _ = diff_strings()
+    ipset_to_add, _ = diff_ipset()
+
+    print(f'{args.entries} entries, {args.changed} changed, best of {args.repeat}')
+    print(f'{"":<8} {"build":>10} {"diff":>10} {"memory":>10} {"to add":>10}')
+    for name, build, diff, to_add in (
+            ('strings', lambda: set(current), diff_strings, strings_to_add),
+            ('ipset', lambda: IPSet(current), diff_ipset, ipset_to_add),
+    ):
+        print(
+            f'{name:<8} {measure(build, 1) * 1000:>8.1f}ms {measure(diff, args.repeat) * 1000:>8.1f}ms '
+            f'{memory(build) / 1024 / 1024:>8.1f}MB {len(to_add):>10}'
+        )
+
+
+if __name__ == '__main__':
+    main()
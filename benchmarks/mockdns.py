@@ -0,0 +1,62 @@
+"""
+Local DNS responder for benchmarks: every name has two A records derived from the name,
+names starting with nx get NXDOMAIN. Answers come from memory, so resolver overhead is what is measured.
+"""
+import hashlib
+import socket
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rrset
+
+TTL = 300
+
+
+def addresses(name: str) -> list:
+    digest = hashlib.md5(name.encode()).digest()
+    return [f'10.{digest[0]}.{digest[1]}.{digest[2]}', f'10.{digest[3]}.{digest[4]}.{digest[5]}']
+
+
+class MockDNSServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.2)
+        self.host, self.port = self._sock.getsockname()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _answer(self, data: bytes) -> bytes:
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        name = query.question[0].name.to_text()
+        if name.startswith('nx'):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        else:
+            response.answer.append(dns.rrset.from_text(name, TTL, 'IN', 'A', *addresses(name.rstrip('.'))))
+        return response.to_wire()
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                data, address = self._sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            self._sock.sendto(self._answer(data), address)
+
+    def start(self) -> 'MockDNSServer':
+        self._thread = threading.Thread(target=self._serve, name='mock-dns', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._sock.close()
+
+    def __enter__(self) -> 'MockDNSServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
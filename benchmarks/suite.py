@@ -0,0 +1,318 @@
+"""
+Hot paths of configurator, resolver and models on synthetic data of several sizes.
+Every case reports latency percentiles of one run, throughput in items per second and peak memory as JSON,
+a previous result given with --compare is checked for regressions.
+
+    python -m benchmarks.suite --sizes 1000,10000,100000 --output bench.json
+    python -m benchmarks.suite --compare bench.json
+
+Device outputs are rendered from the same data in the format devices print them, DNS is benchmarks.mockdns,
+DB is in-memory SQLite.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from statistics import mean, quantiles
+from typing import Callable, Optional
+
+from flask import Flask
+from sqlalchemy import insert, text
+
+import configurator
+import resolver
+from benchmarks.ipset import generate_ips
+from benchmarks.mockdns import MockDNSServer
+from configurator.acl_parser import PREFIX_WILDCARD
+from configurator.ipset import IPSet
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Every case runs at least MIN_RUNS times and then until MIN_TIME seconds or MAX_RUNS runs
+MIN_RUNS = 3
+MAX_RUNS = 200
+MIN_TIME = 1.0
+# p50 slower than in the compared run by more than this is a regression
+DEFAULT_THRESHOLD = 0.1
+
+# Queries per second to the mock DNS, far over what the suite makes
+DNS_RATE = 100000
+
+# Share of entries that differ between resolved IPs and the device
+CHANGED = 0.01
+
+
+class FakeConnection:
+    """ Answers send_command with recorded device output """
+
+    def __init__(self, outputs: dict):
+        self.outputs = outputs
+
+    def send_command(self, command: str, **kwargs) -> str:
+        return self.outputs[command]
+
+
+def cisco_output(ips: IPSet, acl_name: str) -> str:
+    """ show ip access-lists of an IN ACL with ips, the way IOS prints it """
+    rnd = random.Random(0)
+    lines = [f'Extended IP access list {acl_name}']
+    seq = 10
+    for network, prefixlen in ips.cidrs():
+        address = f'host {network}' if prefixlen == 32 else f'{network} {PREFIX_WILDCARD[prefixlen]}'
+        matches = f' ({rnd.randint(1, 100000)} matches)' if rnd.random() < 0.5 else ''
+        lines.append(f'    {seq} permit ip any {address}{matches}')
+        seq += 10
+    lines.append(f'    {seq} deny ip any any')
+    return '\n'.join(lines)
+
+
+def juniper_output(ips: IPSet) -> str:
+    """ show configuration groups rdr-nomoney-routes with ips as static routes """
+    lines = ['routing-instances {', '    <*> {', '        routing-options {', '            static {']
+    for network, prefixlen in ips.cidrs():
+        lines.append(f'                route {network}/{prefixlen} next-table inet.0;')
+    lines.extend(['            }', '        }', '    }', '}'])
+    return '\n'.join(lines)
+
+
+def device_ips(ips: list) -> IPSet:
+    """ The same set as a device has it: some entries are gone, some are new """
+    changed = max(1, int(len(ips) * CHANGED))
+    return IPSet(ips[changed:] + generate_ips(changed, seed=1))
+
+
+def case_generate_cisco(size: int) -> (Callable, int):
+    ips = IPSet(generate_ips(size))
+    return lambda: sum(1 for _ in configurator.generate_cisco(ips, 'TO-OG', 'OG-OUT')), 2 * len(ips)
+
+
+def case_generate_juniper(size: int) -> (Callable, int):
+    ips = IPSet(generate_ips(size))
+    return lambda: sum(1 for _ in configurator.generate_juniper(ips)), len(ips)
+
+
+def case_netlist_cisco(size: int) -> (Callable, int):
+    ips = IPSet(generate_ips(size))
+    c = FakeConnection({
+        'show ip access-lists TO-OG': cisco_output(ips, 'TO-OG'),
+        'show ip access-lists OG-OUT': cisco_output(ips, 'OG-OUT'),
+    })
+    return lambda: configurator.netlist_cisco(c, 'TO-OG', 'OG-OUT'), 2 * len(ips)
+
+
+def case_netlist_juniper(size: int) -> (Callable, int):
+    ips = IPSet(generate_ips(size))
+    c = FakeConnection({'show configuration groups rdr-nomoney-routes': juniper_output(ips)})
+    return lambda: configurator.netlist_juniper(c), len(ips)
+
+
+def case_diff(size: int) -> (Callable, int):
+    """ Set arithmetic of get_diff """
+    ips = generate_ips(size)
+    resolved_ips = IPSet(ips)
+
+    def diff():
+        current_ips = device_ips(ips)
+        return current_ips == resolved_ips, list(current_ips - resolved_ips), list(resolved_ips - current_ips)
+
+    return diff, size
+
+
+def case_resolve_stream(size: int) -> (Callable, int):
+    domains = [f'host{i}.bench.example' for i in range(size)]
+    return lambda: sum(1 for _ in resolver.resolve_stream(domains, concurrency=50, timeout=2)), size
+
+
+def models_app() -> Flask:
+    # Imported here, webapp needs its settings
+    from webapp.models import db
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def fill_db(size: int) -> list:
+    """ size IPs over size / 10 resources, returns resource ids """
+    from webapp.models import db, Resource, IP
+
+    # Full text index is not a model table, drop_all leaves it
+    db.session.execute(text('DROP TABLE IF EXISTS resource_fts'))
+    db.drop_all()
+    db.create_all()
+    resources = size // 10
+    db.session.execute(insert(Resource), [
+        {'name': f'site{i}.bench.example', 'resource_type': 'TECH', 'status': Resource.STATUS_RESOLVED}
+        for i in range(resources)
+    ])
+    ips = generate_ips(size)
+    db.session.execute(insert(IP), [{'resource_id': i % resources + 1, 'ip': ip} for i, ip in enumerate(set(ips))])
+    db.session.commit()
+    return list(range(1, resources + 1))
+
+
+def case_update_ips(size: int) -> (Callable, int):
+    """ One resource resolved through DNS and synced, in a table of size IPs """
+    from webapp.models import db, Resource
+
+    resource_ids = fill_db(size)
+    rnd = random.Random(0)
+
+    def update():
+        resource = db.session.get(Resource, rnd.choice(resource_ids))
+        resource.update_ips()
+
+    return update, 1
+
+
+def case_sync_ips(size: int) -> (Callable, int):
+    """ Resolve results of all resources saved at once, a share of them changed """
+    from webapp.models import Resource
+
+    resource_ids = fill_db(size)
+    rnd = random.Random(0)
+
+    def sync():
+        resolved = {resource_id: {f'10.0.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}'} for resource_id in resource_ids}
+        return Resource.sync_ips(resolved)
+
+    return sync, len(resource_ids)
+
+
+# name -> (prepare(size) -> (run, items per run), largest size or None, needs app context)
+CASES = {
+    'configurator.generate_cisco': (case_generate_cisco, None, False),
+    'configurator.generate_juniper': (case_generate_juniper, None, False),
+    'configurator.netlist_cisco': (case_netlist_cisco, None, False),
+    'configurator.netlist_juniper': (case_netlist_juniper, None, False),
+    'configurator.diff': (case_diff, None, False),
+    'resolver.resolve_stream': (case_resolve_stream, 10000, False),
+    'models.update_ips': (case_update_ips, 1000000, True),
+    'models.sync_ips': (case_sync_ips, 100000, True),
+}
+
+
+def percentile(values: list, n: int) -> float:
+    if len(values) < 2:
+        return values[0]
+    return quantiles(values, n=100, method='inclusive')[n - 1]
+
+
+def measure(run: Callable, items: int) -> dict:
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < MIN_RUNS or (time.perf_counter() - started < MIN_TIME and len(timings) < MAX_RUNS):
+        run_started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - run_started)
+
+    # Separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'runs': len(timings),
+        'items': items,
+        'mean_ms': round(mean(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p90_ms': round(percentile(timings, 90) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'items_per_s': round(items / mean(timings), 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_suite(sizes: list, cases: list) -> list:
+    app = None
+    results = []
+
+    with MockDNSServer() as dns_server:
+        # Rate limit of the pool is lifted, the code is measured and not the limit
+        resolver.configure_pool(nameservers=[dns_server.host], port=dns_server.port, rate=DNS_RATE, max_rate=DNS_RATE)
+
+        for name in cases:
+            prepare, max_size, needs_app = CASES[name]
+            for size in sizes:
+                if max_size and size > max_size:
+                    continue
+
+                if needs_app and app is None:
+                    app = models_app()
+
+                if needs_app:
+                    with app.app_context():
+                        result = measure(*prepare(size))
+                else:
+                    result = measure(*prepare(size))
+
+                result = {'case': name, 'size': size, **result}
+                results.append(result)
+                print(
+                    f'{name:<32} {size:>8} {result["p50_ms"]:>10.2f}ms p50 {result["p99_ms"]:>10.2f}ms p99 '
+                    f'{result["items_per_s"]:>12.0f}/s {result["peak_kb"]:>10.0f}KB',
+                    file=sys.stderr,
+                )
+
+    return results
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """ Cases with p50 slower than in baseline by more than threshold """
+    previous = {(result['case'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['case'], result['size']))
+        if before is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else 1.0
+        mark = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{result["case"]:<32} {result["size"]:>8} {before["p50_ms"]:>10.2f}ms -> {result["p50_ms"]:>10.2f}ms '
+              f'x{ratio:.2f} {mark}', file=sys.stderr)
+        if mark:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated, e.g. 1000,1000000')
+    parser.add_argument('--cases', default='', help='comma separated name prefixes, e.g. configurator,models.sync_ips')
+    parser.add_argument('--output', help='JSON result file, stdout by default')
+    parser.add_argument('--compare', help='previous JSON result, exit code 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    prefixes = [prefix for prefix in args.cases.split(',') if prefix]
+    cases = [name for name in CASES if not prefixes or any(name.startswith(prefix) for prefix in prefixes)]
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': run_suite(sizes, cases),
+    }
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report['results'], json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,39 @@
-import re
+import atexit
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict
 from enum import Enum
-from ipaddress import IPv4Network
+from typing import Callable, Iterable, Iterator, Optional
 
 from loguru import logger
 from netmiko import ConnectHandler
 from netmiko.exceptions import NetmikoAuthenticationException, NetmikoTimeoutException, ReadTimeout
-from tqdm import tqdm
 
 import netbox_client
-from webapp.settings import NB_BRASS_ID, NB_CISCO
+from configurator.acl_parser import ACTION_DENY, ACTION_PERMIT, ANY, PREFIX_WILDCARD, parse_cisco_acl
+from configurator.ipset import IPSet, as_ipset, format_key, to_key
+from configurator.push import AdaptivePusher, PushProfile
+from configurator.sessions import SessionPool, SessionPoolTimeout
+from configurator.state import DeviceStateCache, KEY_ACL_NAMES, KEY_CONFIG_HASH
+from webapp.settings import (
+    NB_BRASS_ID,
+    NB_CISCO,
+    SESSION_IDLE_TTL,
+    SESSION_MAX_PER_DEVICE,
+    SESSION_ACQUIRE_TIMEOUT,
+    DEVICE_STATE_FILE,
+)
 
 VENDOR_JUNIPER = 'juniper'
 VENDOR_CISCO = 'cisco'
 
 VENDORS = {VENDOR_JUNIPER, VENDOR_CISCO}
 
+DEVICE_TYPES = {
+    VENDOR_CISCO: 'cisco_ios_telnet',
+    VENDOR_JUNIPER: 'juniper_junos',
+}
+
 # ACL names on brasses
 ACL_NAMES_OUT = [
     'OG-OUT',
@@ -38,6 +57,15 @@ ACL_NAMES_IN = [
     'TO-OPEN-GARDEN-1.8',
 ]
 
+# ACL directions: IN permits traffic to resources, OUT - from resources
+ACL_IN = 'in'
+ACL_OUT = 'out'
+
+# Step of ACL sequence numbers after resequence
+SEQ_STEP = 10
+
+JUNIPER_STATIC = 'groups rdr-nomoney-routes routing-instances <*> routing-options static'
+
 
 class OGTimeoutException(Exception):
     pass
@@ -66,6 +94,35 @@ class Status(Enum):
     DEVICECONFIGURED = 4
 
 
+session_pool = SessionPool(
+    idle_ttl=SESSION_IDLE_TTL, max_per_device=SESSION_MAX_PER_DEVICE, acquire_timeout=SESSION_ACQUIRE_TIMEOUT,
+)
+session_pool.start_reaper()
+atexit.register(session_pool.close_idle, all_sessions=True)
+# Runs first, reaper does not race with closing all sessions
+atexit.register(session_pool.stop_reaper)
+
+device_state = DeviceStateCache(DEVICE_STATE_FILE)
+
+
+@contextmanager
+def device_session(
+        host: str,
+        vendor: str,
+        username: str,
+        password: str,
+        acquire_timeout: Optional[float] = None,
+) -> ConnectHandler:
+    """ acquire_timeout is how long to wait for a session busy with another operation """
+    try:
+        with session_pool.session(host, DEVICE_TYPES[vendor], username, password, acquire_timeout) as c:
+            yield c
+    except NetmikoAuthenticationException:
+        raise OGAuthenticationException from None
+    except (NetmikoTimeoutException, SessionPoolTimeout):
+        raise OGTimeoutException from None
+
+
 def retrieve_acl_names(c: ConnectHandler) -> tuple:
     og_in = ''
     og_out = ''
@@ -81,112 +138,147 @@ def retrieve_acl_names(c: ConnectHandler) -> tuple:
     return og_in, og_out
 
 
-def configure(host: str, vendor: str, ips: set, username: str, password: str) -> dict:
-
+def cisco_acl_names(host: str, c: ConnectHandler, refresh: bool = False) -> tuple:
+    """ ACL names from device state cache, detected on device when unknown or refresh """
+    acl_names = None if refresh else device_state.acl_names(host)
+    if acl_names is None:
+        acl_names = retrieve_acl_names(c)
+        # No ACL is not remembered, the device is asked again once ACLs are added
+        if any(acl_names):
+            device_state.set_acl_names(host, *acl_names)
+        else:
+            device_state.invalidate(host, KEY_ACL_NAMES)
+    return acl_names
+
+
+def optimize_ips(ips: Iterable) -> (IPSet, int):
+    """
+    Aggregate ACL entries before rendering.
+    Returns optimized entries and number of entries saved.
+    """
+    ips = as_ipset(ips)
+    optimized = ips.aggregate()
+    saved = len(ips) - len(optimized)
+    logger.info(f'ACL optimization: {len(ips)} -> {len(optimized)} entries')
+    return optimized, saved
+
+
+def configure(
+        host: str,
+        vendor: str,
+        ips: set,
+        username: str,
+        password: str,
+        optimize: bool = False,
+        incremental: bool = False,
+        progress: Optional[Callable] = None,
+        skip_unchanged: bool = False,
+) -> dict:
+    """
+    progress(lines pushed, total lines) is called while config is pushed.
+    With skip_unchanged a device last configured with the same IP set is reported up to date
+    without opening a session.
+    """
     if vendor not in VENDORS:
         raise ValueError(f'Unknown vendor {vendor}')
+
+    ips = as_ipset(ips)
+    target_hash = config_hash(ips, optimize)
+    if skip_unchanged and device_state.config_hash(host) == target_hash:
+        logger.info(f'{host}: already configured with {target_hash["hash"]}, skipped')
+        return {'status': Status.UPTODATE, 'config_lines': [], 'saved_lines': 0, 'skipped': True}
+
     if vendor == VENDOR_CISCO:
-        return configure_cisco(host, ips, username, password)
-    elif vendor == VENDOR_JUNIPER:
-        return configure_juniper(host, ips, username, password)
+        config = configure_cisco(host, ips, username, password, optimize, incremental, progress)
+    else:
+        config = configure_juniper(host, ips, username, password, optimize, incremental, progress)
 
+    if config['status'] in (Status.DEVICECONFIGURED, Status.UPTODATE):
+        device_state.set_config_hash(host, target_hash)
+    return config
 
-def netlist_cisco(c: ConnectHandler, og_in: str, og_out: str) -> set:
-    result = set()
-    host_regexp = r'\d+\.\d+\.\d+\.\d+'
-    data = c.send_config_set(
-        [
-            f'do show ip access-lists {og_in}',
-            f'show ip access-lists {og_out}',
-        ]
-    )
 
-    for line in data.splitlines():
-        if 'permit' in line:
-            ip_mask = re.findall(host_regexp, line)
-            if len(ip_mask) > 1:
-                ip = ip_mask[0]
-                wild_mask = ip_mask[1]
-                network = IPv4Network(f'{ip}/{wild_mask}')
-                result.add(f'{ip}/{network.prefixlen}')
-            else:
-                result.add(''.join(ip_mask))
-    return result
+def config_hash(ips: IPSet, optimize: bool) -> dict:
+    return {'hash': ips.digest(), 'optimize': optimize}
 
 
-def netlist_juniper(c: ConnectHandler) -> set:
+def netlist_cisco(c: ConnectHandler, og_in: str, og_out: str) -> IPSet:
+    result = set()
+    for acl_name in (og_in, og_out):
+        data = c.send_command(f'show ip access-lists {acl_name}')
+        for entry in parse_cisco_acl(data.splitlines()):
+            if entry.action == ACTION_PERMIT and entry.address:
+                result.add(entry.address)
+    return IPSet(result)
+
+
+def netlist_juniper(c: ConnectHandler) -> IPSet:
     result = set()
     data = c.send_command('show configuration groups rdr-nomoney-routes')
     for line in data.splitlines():
         parts = line.split()
         if 'route' in parts:
-            netw = parts[1]
-            if '/32' in netw:
-                host = netw.split('/')[0]
-                result.add(host)
-            else:
-                result.add(netw)
-    return result
-
-
-def get_diff(host: str, vendor: str, resolved_ips: set, username: str, password: str) -> dict:
+            result.add(parts[1])
+    return IPSet(result)
+
+
+def get_diff(
+        host: str,
+        vendor: str,
+        resolved_ips: Iterable,
+        username: str,
+        password: str,
+        optimize: bool = False,
+        use_cached: bool = False,
+) -> dict:
+    """
+    With use_cached last known device state is used when there is one, without opening a session,
+    cached is True in the result then.
+    """
     diff_dict = {
         'status': Status.OK,
         'to_delete': set(),
         'to_add': set(),
+        'cached': False,
     }
 
     if vendor not in VENDORS:
         raise ValueError(f'Unknown vendor {vendor}')
-    if vendor == VENDOR_CISCO:
-        try:
-            c = ConnectHandler(
-                host=host,
-                username=username,
-                password=password,
-                device_type='cisco_ios_telnet',
-            )
-        except NetmikoAuthenticationException:
-            raise OGAuthenticationException from None
-        except NetmikoTimeoutException:
-            raise OGTimeoutException from None
-
-        og_in, og_out = retrieve_acl_names(c)
 
-        if not og_in and not og_out:
-            diff_dict['status'] = Status.NOACL
-            return diff_dict
+    # Compare with the same entries configure() would push
+    resolved_ips = as_ipset(resolved_ips)
+    if optimize:
+        resolved_ips, _ = optimize_ips(resolved_ips)
 
-        current_ips = netlist_cisco(c, og_in, og_out)
+    current_ips = device_state.ips(host) if use_cached else None
+    diff_dict['cached'] = current_ips is not None
 
-        if current_ips == resolved_ips:
-            diff_dict['status'] = Status.UPTODATE
-            return diff_dict
+    if current_ips is None:
+        if vendor == VENDOR_CISCO:
+            with device_session(host, VENDOR_CISCO, username, password) as c:
+                og_in, og_out = cisco_acl_names(host, c)
 
-        diff_dict['to_delete'] = sorted(current_ips - resolved_ips)
-        diff_dict['to_add'] = sorted(resolved_ips - current_ips)
+                if not og_in and not og_out:
+                    diff_dict['status'] = Status.NOACL
+                    return diff_dict
 
-    elif vendor == VENDOR_JUNIPER:
-        try:
-            c = ConnectHandler(
-                host=host,
-                username=username,
-                password=password,
-                device_type='juniper_junos',
-            )
-        except NetmikoAuthenticationException:
-            raise OGAuthenticationException from None
-        except NetmikoTimeoutException:
-            raise OGTimeoutException from None
+                current_ips = netlist_cisco(c, og_in, og_out)
 
-        current_ips = netlist_juniper(c)
+        elif vendor == VENDOR_JUNIPER:
+            with device_session(host, VENDOR_JUNIPER, username, password) as c:
+                current_ips = netlist_juniper(c)
+
+        device_state.set_ips(host, current_ips)
 
-        if current_ips == resolved_ips:
-            diff_dict['status'] = Status.UPTODATE
-            return diff_dict
+    if current_ips == resolved_ips:
+        diff_dict['status'] = Status.UPTODATE
+        return diff_dict
 
-        diff_dict['to_delete'] = sorted(current_ips - resolved_ips)
-        diff_dict['to_add'] = sorted(resolved_ips - current_ips)
+    # Device was changed since it was configured, it must not be skipped as up to date
+    device_state.invalidate(host, KEY_CONFIG_HASH)
+
+    diff_dict['to_delete'] = list(current_ips - resolved_ips)
+    diff_dict['to_add'] = list(resolved_ips - current_ips)
 
     return diff_dict
 
@@ -198,181 +290,329 @@ def print_diff(current_ips: set, resolved_ips: set):
     return to_delete, to_add
 
 
-def configure_cisco(host: str, ips: set, username: str, password: str):
+def configure_cisco(
+        host: str,
+        ips: Iterable,
+        username: str,
+        password: str,
+        optimize: bool = False,
+        incremental: bool = False,
+        progress: Optional[Callable] = None,
+):
     config = {
         'status': Status.OK,
-        'config_lines': []
+        'config_lines': [],
+        'saved_lines': 0,
     }
 
-    try:
-        c = ConnectHandler(
-            host=host,
-            username=username,
-            password=password,
-            device_type='cisco_ios_telnet',
-        )
-    except NetmikoAuthenticationException:
-        raise OGAuthenticationException
-    except NetmikoTimeoutException:
-        raise OGTimeoutException
-
-    og_in, og_out = retrieve_acl_names(c)
+    ips = as_ipset(ips)
 
-    if not og_in and not og_out:
-        config['status'] = Status.NOACL
-        return config
+    with device_session(host, VENDOR_CISCO, username, password) as c:
+        # Names are checked on device before writing, it is one command in an open session
+        og_in, og_out = cisco_acl_names(host, c, refresh=True)
 
-    current_ips = netlist_cisco(c, og_in, og_out)
+        if not og_in and not og_out:
+            config['status'] = Status.NOACL
+            return config
 
-    commands = generate_cisco(ips, og_in, og_out)
-    config['config_lines'] = commands
+        if optimize:
+            ips, saved = optimize_ips(ips)
+            # Every entry is rendered in both IN and OUT ACLs
+            config['saved_lines'] = saved * 2
+
+        if incremental:
+            commands = []
+            for acl_name, direction in ((og_in, ACL_IN), (og_out, ACL_OUT)):
+                if acl_name:
+                    commands.extend(delta_cisco_acl(c, ips, acl_name, direction))
+
+            if not commands:
+                config['status'] = Status.UPTODATE
+                device_state.set_ips(host, ips)
+                return config
+        else:
+            commands = list(generate_cisco(ips, og_in, og_out))
 
-    c.config_mode()
+        config['config_lines'] = commands
 
-    chunk_size = 25
+        c.config_mode()
 
-    for start_id in tqdm(range(0, len(commands), chunk_size)):
-        c.send_config_set(
-            commands[start_id:start_id + chunk_size],
-            enter_config_mode=False,
-            exit_config_mode=False,
-            cmd_verify=False,
-            read_timeout=25,
-        )
+        pusher = AdaptivePusher(c, PushProfile.from_dict(device_state.push_profile(host)))
+        try:
+            push = pusher.push(commands, progress)
+        except ReadTimeout:
+            raise OGTimeoutException
+        finally:
+            # Slow device is remembered even if it did not make it this time
+            device_state.set_push_profile(host, pusher.profile.to_dict())
+        device_state.set_push_timings(host, [asdict(timing) for timing in push.chunks])
 
-    c.exit_config_mode()
+        config['push'] = push.summary()
+        logger.info(f'{host}: pushed {config["push"]}, chunk size {pusher.profile.chunk_size}')
+        for error in push.errors:
+            logger.warning(f'{host}: {error}')
 
-    try:
-        c.send_command('write', read_timeout=40)
-    except ReadTimeout:
-        raise OGWriteTimeoutException
+        c.exit_config_mode()
 
-    config['status'] = Status.DEVICECONFIGURED
+        try:
+            c.send_command('write', read_timeout=40)
+        except ReadTimeout:
+            raise OGWriteTimeoutException
 
-    c.disconnect()
+        config['status'] = Status.DEVICECONFIGURED
+        device_state.set_ips(host, ips)
 
     return config
 
 
-def configure_juniper(host: str, ips: set, username: str, password: str):
+def delta_cisco_acl(c: ConnectHandler, ips: Iterable, acl_name: str, direction: str) -> list:
+    """
+    Commands to bring ACL to ips by sequence numbers, without rebuilding it.
+    Sequence numbers are renumbered once if there are not enough free ones,
+    whole ACL is rebuilt when it is still not enough or there is no final deny.
+    """
+    ips = as_ipset(ips)
+
+    entries, deny_seq = read_cisco_acl(c, acl_name)
+    commands = generate_cisco_delta(ips, entries, deny_seq, acl_name, direction)
+
+    if commands is None and deny_seq is not None:
+        c.send_config_set([f'ip access-list resequence {acl_name} {SEQ_STEP} {SEQ_STEP}'])
+        entries, deny_seq = read_cisco_acl(c, acl_name)
+        commands = generate_cisco_delta(ips, entries, deny_seq, acl_name, direction)
+
+    if commands is None:
+        logger.info(f'{acl_name}: not enough free sequence numbers, rebuilding ACL')
+        return list(generate_cisco_acl(ips, acl_name, direction))
+
+    return commands
+
+
+def read_cisco_acl(c: ConnectHandler, acl_name: str) -> (dict, Optional[int]):
+    """
+    ACL permit entries as normalized ip -> sorted sequence numbers of its lines and sequence number of final deny.
+    One ip may have several lines when the ACL has duplicates.
+    """
+    entries = defaultdict(list)
+    deny_seq = None
+
+    data = c.send_command(f'show ip access-lists {acl_name}')
+    for entry in parse_cisco_acl(data.splitlines()):
+        if entry.seq is None:
+            continue
+
+        if entry.action == ACTION_DENY:
+            if entry.src == ANY and entry.dst == ANY:
+                deny_seq = entry.seq
+        elif entry.action == ACTION_PERMIT and entry.address:
+            try:
+                address = format_key(to_key(entry.address))
+            except ValueError:
+                # Not an entry this tool manages
+                continue
+            entries[address].append(entry.seq)
+
+    for seqs in entries.values():
+        seqs.sort()
+    return dict(entries), deny_seq
+
+
+def generate_cisco_delta(
+        ips: IPSet,
+        entries: dict,
+        deny_seq: Optional[int],
+        acl_name: str,
+        direction: str,
+) -> Optional[list]:
+    """ None if there are not enough free sequence numbers before final deny """
+    if deny_seq is None:
+        return None
+
+    current_ips = IPSet(entries)
+    # Duplicate lines of an ip are deleted whether the ip stays or not
+    to_delete = [seq for seqs in entries.values() for seq in seqs[1:]]
+    to_delete.extend(entries[ip][0] for ip in current_ips - ips)
+    to_add = ips - current_ips
+
+    if not to_delete and not to_add:
+        return []
+
+    used = {seq for seqs in entries.values() for seq in seqs} - set(to_delete)
+    free = (seq for seq in range(1, deny_seq) if seq not in used)
+
+    commands = [f'ip access-list extended {acl_name}']
+    commands.extend(f'no {seq}' for seq in sorted(to_delete))
+
+    for entry in cisco_entries(to_add, direction):
+        seq = next(free, None)
+        if seq is None:
+            return None
+        commands.append(f'{seq} {entry}')
+
+    return commands
+
+
+def cisco_entries(ips: IPSet, direction: str) -> Iterator[str]:
+    for network, prefixlen in ips.cidrs():
+        if prefixlen == 32:
+            address = f'host {network}'
+        else:
+            address = f'{network} {PREFIX_WILDCARD[prefixlen]}'
+
+        if direction == ACL_IN:
+            yield f'permit ip any {address}'
+        else:
+            yield f'permit ip {address} any'
+
+
+def configure_juniper(
+        host: str,
+        ips: Iterable,
+        username: str,
+        password: str,
+        optimize: bool = False,
+        incremental: bool = False,
+        progress: Optional[Callable] = None,
+):
     config = {
         'status': Status.OK,
-        'config_lines': []
+        'config_lines': [],
+        'saved_lines': 0,
     }
 
-    try:
-        c = ConnectHandler(
-            host=host,
-            username=username,
-            password=password,
-            device_type='juniper_junos',
-        )
-    except NetmikoAuthenticationException:
-        raise OGAuthenticationException
-    except NetmikoTimeoutException:
-        raise OGTimeoutException
+    ips = as_ipset(ips)
+
+    with device_session(host, VENDOR_JUNIPER, username, password) as c:
+        current_ips = netlist_juniper(c)
 
-    current_ips = netlist_juniper(c)
+        if optimize:
+            ips, config['saved_lines'] = optimize_ips(ips)
 
-    commands = generate_juniper(ips)
-    commands.append('commit')
-    c.send_config_set(commands, config_mode_command='configure exclusive')
-    c.disconnect()
+        if incremental:
+            commands = generate_juniper_delta(ips, current_ips)
+            if not commands:
+                # Nothing to commit
+                config['status'] = Status.UPTODATE
+                device_state.set_ips(host, current_ips)
+                return config
+        else:
+            commands = list(generate_juniper(ips))
+
+        commands.append('commit')
+        if progress:
+            progress(0, len(commands))
+        c.send_config_set(commands, config_mode_command='configure exclusive')
+        if progress:
+            progress(len(commands), len(commands))
+        device_state.set_ips(host, ips)
 
     config['config_lines'] = commands
     return config
 
-def generate_config(vendor: str, ips: set, host: str, username: str, password: str) -> dict:
+
+def generate_config(
+        vendor: str,
+        ips: Iterable,
+        host: str,
+        username: str,
+        password: str,
+        optimize: bool = False,
+        refresh: bool = False,
+        acquire_timeout: Optional[float] = None,
+) -> dict:
+    """
+    Cisco ACL names are taken from device state cache, device is asked only if they are unknown or refresh.
+    config_lines is a lazy iterator, lines_count is known without generating them.
+    acquire_timeout limits the wait for a device session busy with another operation.
+    """
     config = {
         'status': Status.OK,
-        'config_lines': []
+        'config_lines': iter(()),
+        'lines_count': 0,
+        'saved_lines': 0,
     }
 
     if vendor not in VENDORS:
         raise ValueError(f'Unknown vendor {vendor}')
+
+    ips = as_ipset(ips)
+    saved = 0
+    if optimize:
+        ips, saved = optimize_ips(ips)
+
     if vendor == VENDOR_CISCO:
-        try:
-            c = ConnectHandler(
-                host=host,
-                username=username,
-                password=password,
-                device_type='cisco_ios_telnet',
-            )
-        except NetmikoAuthenticationException:
-            raise OGAuthenticationException
-        except NetmikoTimeoutException:
-            raise OGTimeoutException
+        acl_names = None if refresh else device_state.acl_names(host)
+
+        if acl_names is None:
+            with device_session(host, VENDOR_CISCO, username, password, acquire_timeout) as c:
+                acl_names = cisco_acl_names(host, c, refresh=True)
 
-        og_in, og_out = retrieve_acl_names(c)
+        og_in, og_out = acl_names
 
         if not og_in and not og_out:
             config['status'] = Status.NOACL
             return config
 
         config['config_lines'] = generate_cisco(ips, og_in, og_out)
+        config['lines_count'] = 2 * (len(ips) + 3)
+        config['saved_lines'] = saved * 2
         return config
 
     elif vendor == VENDOR_JUNIPER:
         config['config_lines'] = generate_juniper(ips)
+        config['lines_count'] = len(ips) + 1
+        config['saved_lines'] = saved
         return config
 
 
-def generate_cisco(ips: set, acl_name_in: str, acl_name_out: str) -> list:
-    og_out = [
-        f'no ip access-list extended {acl_name_out}',
-        f'ip access-list extended {acl_name_out}',
-    ]
-    og_in = [
-        f'no ip access-list extended {acl_name_in}',
-        f'ip access-list extended {acl_name_in}',
-    ]
-
-    for ip in ips:
-        if '/' in ip:
-            net = IPv4Network(ip)
-            og_out.append(f'permit ip {net.network_address} {net.hostmask} any')
-            og_in.append(f'permit ip any {net.network_address} {net.hostmask}')
-        else:
-            og_out.append(f'permit ip host {ip} any')
-            og_in.append(f'permit ip any host {ip}')
-    og_out.append('deny ip any any')
-    og_in.append('deny ip any any')
-    return og_in + og_out
-
-
-def generate_juniper(ips: set) -> list:
-    result = ['delete groups rdr-nomoney-routes routing-instances <*> routing-options static']
-    for ip in ips:
-        if '/' not in ip:
-            ip += '/32'
-        result.append(
-            f'set groups rdr-nomoney-routes routing-instances <*> routing-options static route {ip} next-table inet.0'
-        )
+def generate_cisco(ips: IPSet, acl_name_in: str, acl_name_out: str) -> Iterator[str]:
+    yield from generate_cisco_acl(ips, acl_name_in, ACL_IN)
+    yield from generate_cisco_acl(ips, acl_name_out, ACL_OUT)
+
+
+def generate_cisco_acl(ips: IPSet, acl_name: str, direction: str) -> Iterator[str]:
+    yield f'no ip access-list extended {acl_name}'
+    yield f'ip access-list extended {acl_name}'
+    yield from cisco_entries(ips, direction)
+    yield 'deny ip any any'
+
+
+def generate_juniper(ips: IPSet) -> Iterator[str]:
+    yield f'delete {JUNIPER_STATIC}'
+    for network, prefixlen in ips.cidrs():
+        yield f'set {JUNIPER_STATIC} route {network}/{prefixlen} next-table inet.0'
+
+
+def generate_juniper_delta(ips: IPSet, current_ips: IPSet) -> list:
+    """ Only changed routes """
+    result = []
+    for network, prefixlen in (current_ips - ips).cidrs():
+        result.append(f'delete {JUNIPER_STATIC} route {network}/{prefixlen}')
+
+    for network, prefixlen in (ips - current_ips).cidrs():
+        result.append(f'set {JUNIPER_STATIC} route {network}/{prefixlen} next-table inet.0')
     return result
 
 
 def get_juniper_hosts(nb: netbox_client, allowed_routers: list) -> list[netbox_client]:
-    juniper_hosts = []
+    if not allowed_routers:
+        return []
 
-    for router in allowed_routers:
-        try:
-            host = nb.get_device(router)
-        except netbox_client.NBException:
-            raise NetboxConnectionError
-        if host is None:
-            raise NetboxDeviceError
+    try:
+        juniper_hosts = nb.get_devices(name=allowed_routers)
+    except netbox_client.NBException:
+        raise NetboxConnectionError
+
+    if {host.name for host in juniper_hosts} != set(allowed_routers):
+        raise NetboxDeviceError
 
-        juniper_hosts.append(host)
     return juniper_hosts
 
 
 def get_cisco_hosts(nb: netbox_client) -> list[netbox_client]:
     try:
-        cisco_hosts = nb.dcim.devices.filter(status='active', role_id=NB_BRASS_ID, manufacturer_id=NB_CISCO)
+        cisco_hosts = nb.get_devices(status='active', role_id=NB_BRASS_ID, manufacturer_id=NB_CISCO)
     except netbox_client.NBException:
         raise NetboxConnectionError
 
-    if cisco_hosts is None:
-        raise NetboxDeviceError
-
     return cisco_hosts
@@ -0,0 +1,118 @@
+"""
+Line by line parser of Cisco 'show ip access-lists' / 'show running-config' ACL output.
+
+    Extended IP access list TO-OG
+        10 permit ip any host 1.2.3.4 (12 matches)
+        20 permit ip any 10.0.0.0 0.0.0.255
+        30 remark resources
+        40 deny ip any any
+
+Addresses are normalized the same way as the rest of configurator:
+'host 1.2.3.4' -> '1.2.3.4', '10.0.0.0 0.0.0.255' -> '10.0.0.0/24', 'any' -> 'any'.
+Lines which are not ACL entries (headers, standard ACLs, object-groups, non-contiguous wildcards) are skipped.
+"""
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+ACTION_PERMIT = 'permit'
+ACTION_DENY = 'deny'
+ACTION_REMARK = 'remark'
+
+ANY = 'any'
+
+# '0.0.0.255' -> 24
+WILDCARD_PREFIX = {}
+for _prefix in range(33):
+    _wildcard = (1 << (32 - _prefix)) - 1
+    WILDCARD_PREFIX[f'{_wildcard >> 24}.{_wildcard >> 16 & 255}.{_wildcard >> 8 & 255}.{_wildcard & 255}'] = _prefix
+
+# 24 -> '0.0.0.255'
+PREFIX_WILDCARD = {prefix: wildcard for wildcard, prefix in WILDCARD_PREFIX.items()}
+
+
+class AclEntry(NamedTuple):
+    seq: Optional[int]
+    action: str
+    protocol: str = ''
+    src: str = ''
+    dst: str = ''
+    matches: int = 0
+    remark: str = ''
+
+    @property
+    def address(self) -> str:
+        """ Resource address of OG entry: 'any host 1.2.3.4' or 'host 1.2.3.4 any' -> '1.2.3.4', else '' """
+        if self.src == ANY:
+            return '' if self.dst == ANY else self.dst
+        if self.dst == ANY:
+            return self.src
+        return ''
+
+
+def parse_address(parts: list, pos: int) -> (Optional[str], int):
+    """ Address starting at parts[pos] and position after it, None if it is not supported """
+    token = parts[pos]
+    if token == ANY:
+        return ANY, pos + 1
+    if token == 'host':
+        return parts[pos + 1], pos + 2
+
+    prefix = WILDCARD_PREFIX.get(parts[pos + 1])
+    if prefix is None or not token[0].isdigit():
+        return None, pos
+    if prefix == 32:
+        return token, pos + 2
+    return f'{token}/{prefix}', pos + 2
+
+
+def parse_cisco_acl(lines: Iterable[str]) -> Iterator[AclEntry]:
+    # It runs for every line of ACLs with tens of thousands entries, so there are no regexps,
+    # 'any' and 'host' addresses are handled inline and records are made without NamedTuple.__new__
+    make = tuple.__new__
+
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+
+        pos = 0
+        seq = None
+        if parts[0].isdigit():
+            seq = int(parts[0])
+            pos = 1
+
+        try:
+            action = parts[pos]
+            if action == ACTION_REMARK:
+                yield make(AclEntry, (seq, action, '', '', '', 0, ' '.join(parts[pos + 1:])))
+                continue
+            if action != ACTION_PERMIT and action != ACTION_DENY:
+                continue
+
+            matches = 0
+            if parts[-1] == 'matches)' or parts[-1] == 'match)':
+                matches = int(parts[-2][1:])
+
+            protocol = parts[pos + 1]
+
+            src = parts[pos + 2]
+            if src == ANY:
+                pos += 3
+            elif src == 'host':
+                src = parts[pos + 3]
+                pos += 4
+            else:
+                src, pos = parse_address(parts, pos + 2)
+                if src is None:
+                    continue
+
+            dst = parts[pos]
+            if dst == 'host':
+                dst = parts[pos + 1]
+            elif dst != ANY:
+                dst = parse_address(parts, pos)[0]
+                if dst is None:
+                    continue
+        except (IndexError, ValueError):
+            continue
+
+        yield make(AclEntry, (seq, action, protocol, src, dst, matches, ''))
@@ -0,0 +1,77 @@
+"""
+CIDR aggregation of ACL entries.
+Works on integer ranges instead of IPv4Network objects to stay fast on 100k+ entries.
+"""
+import re
+import socket
+from typing import Iterable, Iterator
+
+FULL_RANGE = 1 << 32
+
+# Full dotted quad of decimal octets only, like ipaddress accepts: no short forms like '10.1', no leading zeros
+OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+ADDRESS_RE = re.compile(rf'{OCTET}\.{OCTET}\.{OCTET}\.{OCTET}')
+PREFIXLEN_RE = re.compile(r'\d{1,2}')
+
+
+def parse_address(address: str) -> int:
+    """ Dotted quad to integer, ValueError for anything else """
+    if ADDRESS_RE.fullmatch(address) is None:
+        raise ValueError(f'Bad address: {address}')
+    return int.from_bytes(socket.inet_aton(address), 'big')
+
+
+def to_range(ip: str) -> (int, int):
+    """ '1.2.3.4' or '1.2.3.0/24' to first and last address as integers. Host bits are dropped """
+    address, slash, prefixlen = ip.strip().partition('/')
+    start = parse_address(address)
+    if slash and not PREFIXLEN_RE.fullmatch(prefixlen):
+        raise ValueError(f'Bad prefix length: {ip}')
+    prefixlen = int(prefixlen) if slash else 32
+    if not 0 <= prefixlen <= 32:
+        raise ValueError(f'Bad prefix length: {ip}')
+
+    size = 1 << (32 - prefixlen)
+    start &= ~(size - 1)
+    return start, start + size - 1
+
+
+def collapse(ranges: Iterable) -> list:
+    """ Merge overlapping, covered and adjacent ranges """
+    result = []
+    for start, end in sorted(ranges):
+        if result and start <= result[-1][1] + 1:
+            if end > result[-1][1]:
+                result[-1][1] = end
+        else:
+            result.append([start, end])
+    return result
+
+
+def range_to_cidrs(start: int, end: int) -> Iterator[tuple]:
+    """ Minimal list of (network, prefixlen) covering start..end """
+    while start <= end:
+        size = start & -start or FULL_RANGE
+        while size > end - start + 1:
+            size >>= 1
+        yield start, 33 - size.bit_length()
+        start += size
+
+
+def format_cidr(network: int, prefixlen: int) -> str:
+    """ Hosts are rendered without /32, the same way as resolved IPs """
+    address = socket.inet_ntoa(network.to_bytes(4, 'big'))
+    if prefixlen == 32:
+        return address
+    return f'{address}/{prefixlen}'
+
+
+def aggregate(ips: Iterable) -> list:
+    """
+    Normalise, deduplicate, drop covered entries and collapse adjacent prefixes.
+    Returns sorted entries covering exactly the same addresses.
+    """
+    result = []
+    for start, end in collapse(to_range(ip) for ip in ips):
+        result.extend(format_cidr(network, prefixlen) for network, prefixlen in range_to_cidrs(start, end))
+    return result
@@ -0,0 +1,136 @@
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from loguru import logger
+
+import configurator
+
+FLEET_CONFIGURED = 'configured'
+FLEET_UPTODATE = 'up-to-date'
+FLEET_NOACL = 'NOACL'
+FLEET_AUTH = 'auth'
+FLEET_TIMEOUT = 'timeout'
+FLEET_WRITE_TIMEOUT = 'write-timeout'
+FLEET_ERROR = 'error'
+
+DEFAULT_WORKERS = 10
+
+
+@dataclass
+class DeviceResult:
+    name: str
+    vendor: str
+    status: str
+    duration: float
+    result: Optional[dict] = None
+    error: str = ''
+
+
+def host_vendor(host) -> str:
+    return host.device_type.manufacturer.name.lower()
+
+
+def classify(result: dict) -> str:
+    status = result['status']
+    if status == configurator.Status.UPTODATE:
+        return FLEET_UPTODATE
+    if status == configurator.Status.NOACL:
+        return FLEET_NOACL
+    return FLEET_CONFIGURED
+
+
+class FleetExecutor:
+    """
+    Runs a task against many devices through a thread pool.
+    At most `workers` devices are handled at once, vendor_limits caps devices of one vendor.
+    A failed or slow device only takes its own slot, other devices keep going.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, vendor_limits: Optional[dict] = None):
+        vendor_limits = vendor_limits or {}
+        # Devices under a zero limit would never run and the run would never end
+        if workers < 1:
+            raise ValueError(f'Fleet workers must be at least 1, got {workers}')
+        for vendor, limit in vendor_limits.items():
+            if limit < 1:
+                raise ValueError(f'Fleet limit of {vendor} must be at least 1, got {limit}')
+
+        self.workers = workers
+        self.vendor_limits = vendor_limits
+
+    def _run_one(self, host, task: Callable, classifier: Callable) -> DeviceResult:
+        vendor = host_vendor(host)
+        started = time.monotonic()
+        result = None
+        error = ''
+
+        try:
+            result = task(host)
+        except configurator.OGAuthenticationException:
+            status = FLEET_AUTH
+        except configurator.OGTimeoutException:
+            status = FLEET_TIMEOUT
+        except configurator.OGWriteTimeoutException:
+            status = FLEET_WRITE_TIMEOUT
+        except Exception as e:
+            logger.exception(e)
+            status = FLEET_ERROR
+            error = str(e)
+        else:
+            status = classifier(result)
+
+        duration = time.monotonic() - started
+        logger.info(f'{host.name}: {status} in {duration:.1f}s')
+        return DeviceResult(host.name, vendor, status, duration, result, error)
+
+    def run(
+            self,
+            hosts: Iterable,
+            task: Callable,
+            on_result: Optional[Callable] = None,
+            classifier: Callable = classify,
+    ) -> list:
+        pending = defaultdict(deque)
+        for host in hosts:
+            pending[host_vendor(host)].append(host)
+
+        running = {}
+        running_by_vendor = Counter()
+        results = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for vendor in list(pending):
+                    hosts_queue = pending[vendor]
+                    limit = self.vendor_limits.get(vendor, self.workers)
+
+                    while hosts_queue and len(running) < self.workers and running_by_vendor[vendor] < limit:
+                        future = pool.submit(self._run_one, hosts_queue.popleft(), task, classifier)
+                        running[future] = vendor
+                        running_by_vendor[vendor] += 1
+
+                    if not hosts_queue:
+                        del pending[vendor]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running_by_vendor[running.pop(future)] -= 1
+                    result = future.result()
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+
+        return results
+
+
+def summary(results: list) -> str:
+    lines = [f'{"Device":<30} {"Vendor":<10} {"Status":<15} {"Duration":>10}']
+    for r in sorted(results, key=lambda r: r.name):
+        lines.append(f'{r.name:<30} {r.vendor:<10} {r.status:<15} {r.duration:>9.1f}s')
+
+    totals = Counter(r.status for r in results)
+    lines.append(', '.join(f'{status}: {count}' for status, count in sorted(totals.items())))
+    return '\n'.join(lines)
@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+import configurator
+import netbox_client
+from webapp.settings import NB_BRASS_ID, NB_CISCO
+
+DEFAULT_TTL = 300
+# Seconds before a failed background refresh is tried again
+REFRESH_RETRY = 30
+
+
+class Inventory:
+    """
+    In-memory cache of devices from Netbox.
+    Cisco BRASes and Juniper routers are fetched with one filtered query each.
+    After ttl seconds the cached devices are still served while they are refreshed in background,
+    only the very first fetch is done in the request. A failed refresh keeps the old devices.
+    """
+
+    def __init__(self, nb: netbox_client.NetboxClient, juniper_routers: list, ttl: float = DEFAULT_TTL):
+        self.nb = nb
+        self.juniper_routers = list(juniper_routers)
+        self.ttl = ttl
+        self.fetched_at = None
+
+        self._cisco_hosts = []
+        self._juniper_hosts = []
+        self._by_name = {}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = None
+        self._failed_at = None
+
+    def _fetch(self):
+        """ Netbox is queried without holding self._lock, so readers are not blocked by it """
+        with self._fetch_lock:
+            try:
+                cisco_hosts = self.nb.get_devices(status='active', role_id=NB_BRASS_ID, manufacturer_id=NB_CISCO)
+                juniper_hosts = self.nb.get_devices(name=self.juniper_routers) if self.juniper_routers else []
+            except netbox_client.NBException:
+                raise configurator.NetboxConnectionError from None
+
+            found = {host.name for host in juniper_hosts}
+            if set(self.juniper_routers) - found:
+                raise configurator.NetboxDeviceError
+
+            # Keep configured order of routers
+            juniper_hosts.sort(key=lambda host: self.juniper_routers.index(host.name))
+
+            with self._lock:
+                self._cisco_hosts = cisco_hosts
+                self._juniper_hosts = juniper_hosts
+                self._by_name = {host.name: host for host in juniper_hosts + cisco_hosts}
+                self.fetched_at = time.monotonic()
+                self._failed_at = None
+
+    def _refresh_background(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            logger.warning(f'Netbox inventory refresh failed, keeping devices fetched before: {e!r}')
+            with self._lock:
+                self._failed_at = time.monotonic()
+
+    def _ensure(self):
+        if self.fetched_at is None:
+            # Nothing to serve yet
+            self._fetch()
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            stale = now - self.fetched_at > self.ttl
+            retry = self._failed_at is None or now - self._failed_at > REFRESH_RETRY
+            running = self._refreshing is not None and self._refreshing.is_alive()
+            if not stale or not retry or running:
+                return
+            self._refreshing = threading.Thread(target=self._refresh_background, name='inventory-refresh', daemon=True)
+            self._refreshing.start()
+
+    def refresh(self):
+        """ Fetch now, errors are raised to the caller and the old devices are kept """
+        self._fetch()
+
+    def cisco_hosts(self) -> list:
+        self._ensure()
+        with self._lock:
+            return list(self._cisco_hosts)
+
+    def juniper_hosts(self) -> list:
+        self._ensure()
+        with self._lock:
+            return list(self._juniper_hosts)
+
+    def get(self, name: str) -> Optional[netbox_client.Devices]:
+        self._ensure()
+        with self._lock:
+            return self._by_name.get(name)
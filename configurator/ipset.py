@@ -0,0 +1,187 @@
+"""
+Set of IPv4 prefixes stored as sorted integers.
+Every entry is packed to one 64-bit key: first address << 32 | last address, so the whole set
+is one array('Q') - 8 bytes per entry - and set operations are linear merges of two sorted arrays.
+Entries are normalized on insert: '1.2.3.4' and '1.2.3.4/32' are the same entry, host bits are dropped.
+"""
+import hashlib
+import socket
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+from loguru import logger
+
+from configurator.aggregate import collapse, parse_address, range_to_cidrs, to_range
+
+LAST = (1 << 32) - 1
+
+# Bad entries shown in the warning when a set is built
+BAD_SHOWN = 5
+
+
+def to_key(ip: str) -> int:
+    """ ValueError for anything but a dotted quad address or prefix """
+    if '/' not in ip:
+        start = parse_address(ip)
+        return start << 32 | start
+    start, end = to_range(ip)
+    return start << 32 | end
+
+
+def parse_keys(ips: Iterable) -> list:
+    """ Sorted unique keys, bad entries are skipped with a warning """
+    keys = set()
+    bad = []
+    for ip in ips:
+        try:
+            keys.add(to_key(ip))
+        except ValueError:
+            bad.append(ip)
+    if bad:
+        logger.warning(f'Skipped {len(bad)} bad IP entries: {", ".join(map(repr, bad[:BAD_SHOWN]))}')
+    return sorted(keys)
+
+
+def merge(a: array, b: array, only_a: bool, both: bool, only_b: bool) -> array:
+    """ Keys of two sorted arrays which are only in a, in both or only in b """
+    result = array('Q')
+    append = result.append
+    # Lists are indexed faster than arrays
+    a, b = a.tolist(), b.tolist()
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x < y:
+            if only_a:
+                append(x)
+            i += 1
+        elif x > y:
+            if only_b:
+                append(y)
+            j += 1
+        else:
+            if both:
+                append(x)
+            i += 1
+            j += 1
+    if only_a:
+        result.extend(a[i:])
+    if only_b:
+        result.extend(b[j:])
+    return result
+
+
+def format_address(address: int) -> str:
+    return socket.inet_ntoa(address.to_bytes(4, 'big'))
+
+
+def format_key(key: int) -> str:
+    """ Hosts without /32, the same way as resolved IPs and netlist_* output """
+    start = key >> 32
+    address = format_address(start)
+    size = (key & LAST) - start + 1
+    if size == 1:
+        return address
+    return f'{address}/{33 - size.bit_length()}'
+
+
+class IPSet:
+    """ Immutable, iterates normalized entries as strings in address order """
+
+    __slots__ = ('_keys',)
+
+    def __init__(self, ips: Iterable = ()):
+        if isinstance(ips, IPSet):
+            self._keys = ips._keys
+        else:
+            self._keys = array('Q', parse_keys(ips))
+
+    @classmethod
+    def from_keys(cls, keys: Iterable) -> 'IPSet':
+        """ Keys must be sorted and unique """
+        ipset = cls.__new__(cls)
+        ipset._keys = keys if isinstance(keys, array) else array('Q', keys)
+        return ipset
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'IPSet':
+        keys = array('Q')
+        keys.frombytes(data)
+        return cls.from_keys(keys)
+
+    def to_bytes(self) -> bytes:
+        return self._keys.tobytes()
+
+    def digest(self) -> str:
+        """ Content hash, equal sets have equal digests """
+        return hashlib.sha256(self._keys.tobytes()).hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        return map(format_key, self._keys)
+
+    def __repr__(self) -> str:
+        return f'IPSet({len(self)} entries)'
+
+    def _find(self, key: int) -> bool:
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __contains__(self, ip: str) -> bool:
+        """ ip (an address or a prefix) is covered by one of the entries """
+        try:
+            start, end = to_range(ip)
+        except ValueError:
+            return False
+
+        # Entries are prefixes, so the ones covering start are its networks: at most one per prefix length
+        prefixlen = 33 - (end - start + 1).bit_length()
+        for length in range(prefixlen, -1, -1):
+            size = 1 << (32 - length)
+            network = start & ~(size - 1)
+            if self._find(network << 32 | network + size - 1):
+                return True
+        return False
+
+    def __eq__(self, other) -> bool:
+        return self._keys == as_ipset(other)._keys
+
+    def __or__(self, other: Iterable) -> 'IPSet':
+        return self.from_keys(merge(self._keys, as_ipset(other)._keys, True, True, True))
+
+    def __sub__(self, other: Iterable) -> 'IPSet':
+        return self.from_keys(merge(self._keys, as_ipset(other)._keys, True, False, False))
+
+    def __and__(self, other: Iterable) -> 'IPSet':
+        return self.from_keys(merge(self._keys, as_ipset(other)._keys, False, True, False))
+
+    def ranges(self) -> Iterator[tuple]:
+        """ (first, last) address of every entry as integers """
+        for key in self._keys:
+            yield key >> 32, key & LAST
+
+    def cidrs(self) -> Iterator[tuple]:
+        """ Network address and prefix length of every entry, hosts are /32 here """
+        for key in self._keys:
+            start = key >> 32
+            yield format_address(start), 33 - ((key & LAST) - start + 1).bit_length()
+
+    def aggregate(self) -> 'IPSet':
+        """ Minimal set of prefixes covering exactly the same addresses """
+        keys = []
+        for start, end in collapse(self.ranges()):
+            for network, prefixlen in range_to_cidrs(start, end):
+                keys.append(network << 32 | network + (1 << (32 - prefixlen)) - 1)
+        return self.from_keys(keys)
+
+
+def as_ipset(ips: Iterable) -> IPSet:
+    """ ips itself if it is already an IPSet, so it is not parsed again """
+    return ips if isinstance(ips, IPSet) else IPSet(ips)
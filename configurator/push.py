@@ -0,0 +1,198 @@
+"""
+Adaptive push of config lines to Cisco devices.
+
+Lines are written in chunks and every chunk is read back until the device printed one prompt per line,
+so a chunk is confirmed only when all of its lines are processed, even if some lines repeat.
+Time to the first echoed byte is the round trip, the rest is the time device spends on the lines.
+Next chunk size is picked so a chunk takes about TARGET_CHUNK_TIME on this device,
+a pause between chunks is added while the device is slowing down.
+"""
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from loguru import logger
+from netmiko import ConnectHandler
+from netmiko.exceptions import ReadTimeout
+from tqdm import tqdm
+
+MIN_CHUNK = 5
+MAX_CHUNK = 500
+DEFAULT_CHUNK = 25
+
+TARGET_CHUNK_TIME = 1.0
+# Chunk read timeout is this many times longer than expected chunk time
+TIMEOUT_FACTOR = 5
+MIN_READ_TIMEOUT = 10
+MAX_DELAY = 2.0
+# Weight of the last chunk in line time and round trip averages
+EWMA_WEIGHT = 0.3
+
+POLL_INTERVAL = 0.01
+
+
+@dataclass
+class PushProfile:
+    """ What is known about the device from previous pushes, kept in device state """
+    chunk_size: int = DEFAULT_CHUNK
+    rtt: float = 0.0
+    line_time: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'PushProfile':
+        profile = cls()
+        for key, value in (data or {}).items():
+            if hasattr(profile, key):
+                setattr(profile, key, value)
+        return profile
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class ChunkTiming:
+    lines: int
+    rtt: float
+    echo: float
+    read_timeout: float
+    delay: float
+    timed_out: bool = False
+
+
+@dataclass
+class PushResult:
+    lines: int = 0
+    duration: float = 0.0
+    errors: list = field(default_factory=list)
+    chunks: list = field(default_factory=list)
+
+    def summary(self) -> dict:
+        return {
+            'lines': self.lines,
+            'chunks': len(self.chunks),
+            'duration': round(self.duration, 2),
+            'errors': len(self.errors),
+        }
+
+
+class AdaptivePusher:
+    def __init__(self, c: ConnectHandler, profile: Optional[PushProfile] = None):
+        self.c = c
+        self.profile = profile or PushProfile()
+        self.delay = 0.0
+        self._output = ''
+        self._first_byte = None
+        # Prompts in output: one after every processed line, echo of the next line follows on the same line
+        self._prompts = 0
+        self._scanned = 0
+        self._prompt_line = re.compile(rf'^{re.escape(c.base_prompt)}[^\n]*?[#>]', re.M)
+        self._prompt = re.compile(rf'{re.escape(c.base_prompt)}[^\n]*[#>]\s*$')
+
+    def _expected_time(self, lines: int) -> float:
+        return self.profile.rtt + lines * self.profile.line_time
+
+    def _read_chunk(self, lines: int, deadline: float) -> bool:
+        """
+        Read into self._output until the device printed a prompt after each of lines, False on deadline.
+        Time of the first received byte is kept in self._first_byte.
+        """
+        while True:
+            data = self.c.read_channel()
+            if data:
+                if self._first_byte is None:
+                    self._first_byte = time.monotonic()
+                self._output += data
+
+                # Only complete lines are counted, the last one may still be coming
+                complete = self._output.rfind('\n') + 1
+                if complete > self._scanned:
+                    self._prompts += len(self._prompt_line.findall(self._output, self._scanned, complete))
+                    self._scanned = complete
+                # Prompt after the last line is not followed by a new line
+                waiting = self._prompt.match(self._output, self._scanned) is not None
+                if self._prompts + waiting >= lines:
+                    return True
+            elif time.monotonic() > deadline:
+                return False
+            else:
+                time.sleep(POLL_INTERVAL)
+
+    def _adjust(self, timing: ChunkTiming):
+        profile = self.profile
+        line_time = timing.echo / timing.lines
+
+        if profile.line_time:
+            # Device answers much slower than before, give it time to drain its buffers
+            if line_time > 2 * profile.line_time:
+                self.delay = min(MAX_DELAY, max(self.delay * 2, 0.1))
+            else:
+                self.delay = self.delay / 2 if self.delay > 0.01 else 0.0
+
+            profile.line_time += EWMA_WEIGHT * (line_time - profile.line_time)
+            profile.rtt += EWMA_WEIGHT * (timing.rtt - profile.rtt)
+        else:
+            profile.line_time = line_time
+            profile.rtt = timing.rtt
+
+        if timing.timed_out:
+            profile.chunk_size = max(MIN_CHUNK, profile.chunk_size // 2)
+            return
+
+        ideal = int(TARGET_CHUNK_TIME / profile.line_time) if profile.line_time else MAX_CHUNK
+        # Grow carefully, shrink at once
+        profile.chunk_size = max(MIN_CHUNK, min(MAX_CHUNK, ideal, profile.chunk_size * 2))
+
+    def push(self, commands: list, progress: Optional[Callable] = None) -> PushResult:
+        """ Device must be in config mode. progress(lines pushed, total) is called after every chunk """
+        result = PushResult(lines=len(commands))
+        started = time.monotonic()
+        position = 0
+
+        with tqdm(total=len(commands)) as progress_bar:
+            while position < len(commands):
+                chunk = commands[position:position + self.profile.chunk_size]
+                last_command = chunk[-1].strip()
+                read_timeout = max(MIN_READ_TIMEOUT, TIMEOUT_FACTOR * self._expected_time(len(chunk)))
+                timed_out = False
+
+                chunk_started = time.monotonic()
+                self._output = ''
+                self._first_byte = None
+                self._prompts = 0
+                self._scanned = 0
+                self.c.write_channel(''.join(self.c.normalize_cmd(command) for command in chunk))
+
+                if not self._read_chunk(len(chunk), chunk_started + read_timeout):
+                    # Lines are already sent, one more chance before giving up on the device
+                    logger.warning(f'{self.c.host}: chunk is not confirmed in {read_timeout:.0f}s, waiting more')
+                    timed_out = True
+                    if not self._read_chunk(len(chunk), time.monotonic() + read_timeout * 2):
+                        self.profile.chunk_size = max(MIN_CHUNK, self.profile.chunk_size // 2)
+                        raise ReadTimeout(f'{self.c.host}: no prompt after "{last_command}"')
+
+                finished = time.monotonic()
+                timing = ChunkTiming(
+                    lines=len(chunk),
+                    rtt=self._first_byte - chunk_started,
+                    echo=finished - self._first_byte,
+                    read_timeout=read_timeout,
+                    delay=self.delay,
+                    timed_out=timed_out,
+                )
+                result.chunks.append(timing)
+                result.errors.extend(line for line in self._output.splitlines() if line.startswith('% '))
+                logger.debug(f'{self.c.host}: {timing}')
+
+                self._adjust(timing)
+                position += len(chunk)
+                progress_bar.update(len(chunk))
+                if progress:
+                    progress(position, len(commands))
+
+                if self.delay and position < len(commands):
+                    time.sleep(self.delay)
+
+        result.duration = time.monotonic() - started
+        return result
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+from netmiko import ConnectHandler
+
+DEFAULT_IDLE_TTL = 300
+DEFAULT_MAX_PER_DEVICE = 1
+DEFAULT_ACQUIRE_TIMEOUT = 600
+# Seconds between checks for sessions idle longer than idle TTL
+DEFAULT_REAP_INTERVAL = 30
+
+
+class SessionPoolTimeout(Exception):
+    pass
+
+
+class SessionPool:
+    """
+    Keeps netmiko connections open between operations on the same device.
+    A session is handed to one caller at a time, it is reused within idle_ttl
+    if it is still alive, otherwise a new one is opened.
+    Session is closed instead of returned to pool if caller raised an exception.
+    Sessions idle longer than idle_ttl are closed by a background reaper, see start_reaper().
+    """
+
+    def __init__(
+            self,
+            idle_ttl: float = DEFAULT_IDLE_TTL,
+            max_per_device: int = DEFAULT_MAX_PER_DEVICE,
+            acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT,
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_per_device = max_per_device
+        self.acquire_timeout = acquire_timeout
+
+        self.connects = 0
+        self.reuses = 0
+        self.closes = 0
+
+        # key -> [(connection, released at)]
+        self._idle = defaultdict(list)
+        self._in_use = Counter()
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+
+    @property
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'connects': self.connects,
+                'reuses': self.reuses,
+                'closes': self.closes,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'in_use': sum(self._in_use.values()),
+            }
+
+    def _close(self, c: ConnectHandler):
+        self.closes += 1
+        try:
+            c.disconnect()
+        except Exception as e:
+            logger.debug(f'Session close failed: {e}')
+
+    def _expired(self) -> list:
+        """ Pop idle sessions older than idle_ttl. Must be called with lock """
+        expired = []
+        deadline = time.monotonic() - self.idle_ttl
+        for key in list(self._idle):
+            alive = [(c, released) for c, released in self._idle[key] if released >= deadline]
+            expired.extend(c for c, released in self._idle[key] if released < deadline)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        return expired
+
+    def _acquire(self, key: tuple, acquire_timeout: Optional[float] = None, **connect_kwargs) -> ConnectHandler:
+        deadline = time.monotonic() + (self.acquire_timeout if acquire_timeout is None else acquire_timeout)
+
+        while True:
+            with self._cond:
+                expired = self._expired()
+                while not self._idle.get(key) and self._in_use[key] >= self.max_per_device:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SessionPoolTimeout(f'No free session for {key[0]}')
+                    self._cond.wait(remaining)
+
+                self._in_use[key] += 1
+                idle = self._idle.get(key)
+                c = idle.pop()[0] if idle else None
+
+            for expired_c in expired:
+                self._close(expired_c)
+
+            if c is None:
+                try:
+                    c = ConnectHandler(**connect_kwargs)
+                except Exception:
+                    self._release_slot(key)
+                    raise
+                self.connects += 1
+                return c
+
+            if c.is_alive():
+                self.reuses += 1
+                return c
+
+            self._close(c)
+            self._release_slot(key)
+
+    def _release_slot(self, key: tuple):
+        with self._cond:
+            self._in_use[key] -= 1
+            self._cond.notify_all()
+
+    def _release(self, key: tuple, c: ConnectHandler):
+        with self._cond:
+            self._in_use[key] -= 1
+            self._idle[key].append((c, time.monotonic()))
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(
+            self,
+            host: str,
+            device_type: str,
+            username: str,
+            password: str,
+            acquire_timeout: Optional[float] = None,
+    ):
+        """ acquire_timeout overrides the pool one, raises SessionPoolTimeout when the device stays busy """
+        key = (host, device_type, username)
+        c = self._acquire(
+            key, acquire_timeout, host=host, device_type=device_type, username=username, password=password,
+        )
+        try:
+            yield c
+        except BaseException:
+            # Session state is unknown, don't give it to somebody else
+            self._close(c)
+            self._release_slot(key)
+            raise
+        else:
+            self._release(key, c)
+
+    def close_idle(self, all_sessions: bool = False):
+        with self._cond:
+            if all_sessions:
+                expired = [c for idle in self._idle.values() for c, _ in idle]
+                self._idle.clear()
+            else:
+                expired = self._expired()
+
+        for c in expired:
+            self._close(c)
+
+    def _reap(self, interval: float):
+        while not self._reaper_stop.wait(interval):
+            try:
+                self.close_idle()
+            except Exception as e:
+                logger.warning(f'Idle sessions close failed: {e}')
+
+    def start_reaper(self, interval: float = DEFAULT_REAP_INTERVAL):
+        """ Close idle sessions in a daemon thread, so they are not left open until the next operation """
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper_stop.clear()
+            self._reaper = threading.Thread(target=self._reap, args=(interval,), name='session-reaper', daemon=True)
+            self._reaper.start()
+
+    def stop_reaper(self):
+        with self._cond:
+            reaper, self._reaper = self._reaper, None
+        if reaper is not None:
+            self._reaper_stop.set()
+            reaper.join()
@@ -0,0 +1,81 @@
+"""
+Effective IP set snapshot: the set all devices are configured with, its version and content hash.
+Rebuilt from the source (IP table, networks file) only when the source version changes,
+between rebuilds it is served from memory or from the file it was saved to.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from loguru import logger
+
+from configurator.ipset import IPSet, as_ipset
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int
+    ips: IPSet
+    hash: str
+
+    @classmethod
+    def build(cls, version: int, ips: Iterable) -> 'Snapshot':
+        ips = as_ipset(ips)
+        return cls(version, ips, ips.digest())
+
+
+class SnapshotStore:
+    """
+    Last snapshot in memory and, with path, on disk.
+    File is one JSON line with version and hash followed by the IPSet bytes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, version: int, loader: Callable[[], Iterable]) -> Snapshot:
+        """ Snapshot of version, loader() returns the IPs when it has to be rebuilt """
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                snapshot = self._read()
+                if snapshot is None or snapshot.version != version:
+                    snapshot = Snapshot.build(version, loader())
+                    logger.info(f'IP snapshot v{version} built: {len(snapshot.ips)} entries, hash {snapshot.hash}')
+                    self._write(snapshot)
+                self._snapshot = snapshot
+            return self._snapshot
+
+    def _read(self) -> Optional[Snapshot]:
+        if not self.path or not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline())
+                snapshot = Snapshot.build(header['version'], IPSet.from_bytes(f.read()))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'IP snapshot {self.path} is unreadable: {e}')
+            return None
+
+        if snapshot.hash != header['hash']:
+            logger.warning(f'IP snapshot {self.path} is damaged, rebuilding')
+            return None
+        return snapshot
+
+    def _write(self, snapshot: Snapshot):
+        if not self.path:
+            return
+
+        # Readers of the file never see it half written
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps({'version': snapshot.version, 'hash': snapshot.hash}).encode() + b'\n')
+                f.write(snapshot.ips.to_bytes())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f'IP snapshot is not saved to {self.path}: {e}')
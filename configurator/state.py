@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+from configurator.ipset import IPSet, as_ipset
+
+KEY_ACL_NAMES = 'acl_names'
+KEY_IPS = 'ips'
+KEY_PUSH_PROFILE = 'push_profile'
+KEY_PUSH_TIMINGS = 'push_timings'
+KEY_CONFIG_HASH = 'config_hash'
+
+
+class DeviceStateCache:
+    """
+    Persistent per-device state: detected ACL names, last known ACL/route set and so on.
+    Every value is stored as JSON with the time it was updated.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS device_state ('
+            'host TEXT NOT NULL, '
+            'key TEXT NOT NULL, '
+            'value TEXT NOT NULL, '
+            'updated_at REAL NOT NULL, '
+            'PRIMARY KEY (host, key))'
+        )
+
+    def get(self, host: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, updated_at FROM device_state WHERE host = ? AND key = ?', (host, key)
+            ).fetchone()
+
+        if row is None:
+            return None
+        if max_age is not None and time.time() - row[1] > max_age:
+            return None
+        return json.loads(row[0])
+
+    def updated_at(self, host: str, key: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT updated_at FROM device_state WHERE host = ? AND key = ?', (host, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, host: str, key: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO device_state (host, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                (host, key, json.dumps(value), time.time()),
+            )
+
+    def invalidate(self, host: str, key: Optional[str] = None):
+        """ Forget one value or the whole device state """
+        with self._lock:
+            if key is None:
+                self._conn.execute('DELETE FROM device_state WHERE host = ?', (host,))
+            else:
+                self._conn.execute('DELETE FROM device_state WHERE host = ? AND key = ?', (host, key))
+
+    def acl_names(self, host: str) -> Optional[tuple]:
+        names = self.get(host, KEY_ACL_NAMES)
+        return tuple(names) if names else None
+
+    def set_acl_names(self, host: str, og_in: str, og_out: str):
+        self.set(host, KEY_ACL_NAMES, [og_in, og_out])
+
+    def ips(self, host: str) -> Optional[IPSet]:
+        ips = self.get(host, KEY_IPS)
+        return IPSet(ips) if ips is not None else None
+
+    def set_ips(self, host: str, ips: Iterable):
+        self.set(host, KEY_IPS, list(as_ipset(ips)))
+
+    def push_profile(self, host: str) -> Optional[dict]:
+        return self.get(host, KEY_PUSH_PROFILE)
+
+    def set_push_profile(self, host: str, profile: dict):
+        self.set(host, KEY_PUSH_PROFILE, profile)
+
+    def push_timings(self, host: str) -> Optional[list]:
+        """ Per chunk timings of the last push, for diagnostics """
+        return self.get(host, KEY_PUSH_TIMINGS)
+
+    def set_push_timings(self, host: str, timings: list):
+        self.set(host, KEY_PUSH_TIMINGS, timings)
+
+    def config_hash(self, host: str) -> Optional[dict]:
+        """ Hash of the IP set and optimize flag the device was last configured with """
+        return self.get(host, KEY_CONFIG_HASH)
+
+    def set_config_hash(self, host: str, config_hash: dict):
+        self.set(host, KEY_CONFIG_HASH, config_hash)
@@ -1,14 +1,20 @@
 import getpass
+import os
 import re
 import sys
+from functools import partial
 from itertools import chain
 
 from loguru import logger
 from requests.exceptions import ConnectionError
 
 import configurator
+from configurator.fleet import FleetExecutor, summary
+from configurator.ipset import IPSet
+from configurator.snapshot import SnapshotStore
 import netbox_client
 import resolver
+from resolver.cache import DNSCache
 
 logger.add(
     'gogen.log',
@@ -22,6 +28,9 @@ NB_URL = 'https://netbox-url'
 NB_API_TOKEN = 'token'
 NB_BRASS_ID = 5
 NB_CISCO = 3
+NB_POOL_SIZE = 10
+NB_RETRIES = 3
+NB_PARALLEL = True
 
 ACTION_RESOLVE = 'resolve'
 ACTION_GENERATE = 'generate'
@@ -30,8 +39,29 @@ ACTION_CONFIG_ALL = 'config_all'
 
 RESOURCES_FILE = 'resources.txt'
 NETWORKS_FILE = 'networks.txt'
+# Parsed networks file, reused until the file changes
+NETWORKS_SNAPSHOT = 'networks.snapshot'
 FAILED_FILE = 'failed_domains.txt'
 
+RESOLVE_CONCURRENCY = 50
+RESOLVE_TIMEOUT = 5
+DNS_CACHE_FILE = 'dns_cache.db'
+DNS_NAMESERVERS = []
+DNS_RATE = 50
+DNS_MAX_RATE = 500
+
+OPTIMIZE_ACL = False
+INCREMENTAL_CONFIG = False
+# config_all skips devices last configured with the same networks without connecting to them
+SKIP_CONFIGURED = True
+
+# Devices configured at once by config_all, in total and per vendor
+FLEET_WORKERS = 10
+FLEET_VENDOR_LIMITS = {
+    configurator.VENDOR_CISCO: 8,
+    configurator.VENDOR_JUNIPER: 2,
+}
+
 USERNAME = None
 PASSWORD = None
 
@@ -55,10 +85,21 @@ def resolve_resources():
         else:
             domains.add(resource)
 
+    dns_cache = DNSCache(DNS_CACHE_FILE)
+
     try:
-        resolved_ips, failed_domains = resolver.resolve_domains(domains)
-    except ConnectionError as e:
+        resolver.configure_pool(nameservers=DNS_NAMESERVERS, rate=DNS_RATE, max_rate=DNS_MAX_RATE)
+        resolved_ips, failed_domains = resolver.resolve_domains(
+            domains,
+            concurrency=RESOLVE_CONCURRENCY,
+            timeout=RESOLVE_TIMEOUT,
+            cache=dns_cache,
+        )
+    except (ConnectionError, resolver.DNSConnectionError) as e:
         raise SystemExit(e)
+    finally:
+        dns_cache.evict()
+        dns_cache.close()
 
     ips.update(resolved_ips)
 
@@ -72,22 +113,46 @@ def resolve_resources():
 
     print(f'{len(ips)} networks saved to {NETWORKS_FILE}.')
     print(f'{len(failed_domains)} FAILED domains saved to {FAILED_FILE}.')
+    print(f'DNS cache: {dns_cache.stats}')
 
 
-def configure_acl(host: netbox_client.Devices, ips: set, username: str, password: str):
+def configure_acl(
+        host: netbox_client.Devices,
+        ips: IPSet,
+        username: str,
+        password: str,
+        skip_unchanged: bool = False,
+) -> dict:
     vendor = host.device_type.manufacturer.name.lower()
 
     host_ip = host.primary_ip4.address[:-3]
 
-    configurator.configure(host_ip, vendor, ips, username, password)
+    return configurator.configure(
+        host_ip,
+        vendor,
+        ips,
+        username,
+        password,
+        optimize=OPTIMIZE_ACL,
+        incremental=INCREMENTAL_CONFIG,
+        skip_unchanged=skip_unchanged,
+    )
 
 
-def get_networks() -> set:
+def read_networks() -> IPSet:
     with open(NETWORKS_FILE, 'r') as f:
-        networks = {ip for ip in f.read().splitlines()}
+        networks = IPSet(ip for ip in f.read().splitlines() if ip)
     return networks
 
 
+def get_networks() -> IPSet:
+    try:
+        version = os.stat(NETWORKS_FILE).st_mtime_ns
+    except OSError as e:
+        raise SystemExit(e)
+    return SnapshotStore(NETWORKS_SNAPSHOT).get(version, read_networks).ips
+
+
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         raise SystemExit('No arguments given.')
@@ -105,12 +170,25 @@ if __name__ == '__main__':
         if vendor not in configurator.VENDORS:
             raise SystemExit(f'Unsupported vendor {vendor}')
 
-        print('\n'.join(configurator.generate_config(vendor, get_networks())))
+        networks = get_networks()
+        if OPTIMIZE_ACL:
+            networks, _ = configurator.optimize_ips(networks)
+
+        # No device here, Cisco ACLs get the default names
+        if vendor == configurator.VENDOR_CISCO:
+            lines = configurator.generate_cisco(networks, configurator.ACL_NAMES_IN[0], configurator.ACL_NAMES_OUT[0])
+        else:
+            lines = configurator.generate_juniper(networks)
+
+        for line in lines:
+            sys.stdout.write(f'{line}\n')
 
     elif action == ACTION_CONFIG_DEV:
         hostname = sys.argv[2]
 
-        nb = netbox_client.NetboxClient(NB_URL, NB_API_TOKEN)
+        nb = netbox_client.NetboxClient(
+            NB_URL, NB_API_TOKEN, pool_size=NB_POOL_SIZE, retries=NB_RETRIES, parallel=NB_PARALLEL
+        )
 
         try:
             host = nb.get_device(hostname)
@@ -126,26 +204,39 @@ if __name__ == '__main__':
         configure_acl(host, get_networks(), username, password)
 
     elif action == ACTION_CONFIG_ALL:
-        nb = netbox_client.NetboxClient(NB_URL, NB_API_TOKEN)
+        nb = netbox_client.NetboxClient(
+            NB_URL, NB_API_TOKEN, pool_size=NB_POOL_SIZE, retries=NB_RETRIES, parallel=NB_PARALLEL
+        )
 
-        cisco_hosts = nb.dcim.devices.filter(status='active', role_id=NB_BRASS_ID, manufacturer_id=NB_CISCO)
-
-        juniper_hosts = []
-
-        for router in JUNIPER_ROUTERS:
-            try:
-                host = nb.get_device(router)
-            except netbox_client.NBException as e:
-                raise SystemExit(e)
-            if host is None:
-                raise SystemExit(f'No device in Netbox: {host}')
+        try:
+            cisco_hosts = nb.get_devices(status='active', role_id=NB_BRASS_ID, manufacturer_id=NB_CISCO)
+            juniper_hosts = nb.get_devices(name=JUNIPER_ROUTERS) if JUNIPER_ROUTERS else []
+        except netbox_client.NBException as e:
+            raise SystemExit(e)
 
-            juniper_hosts.append(host)
+        missing = set(JUNIPER_ROUTERS) - {host.name for host in juniper_hosts}
+        if missing:
+            raise SystemExit(f'No device in Netbox: {", ".join(sorted(missing))}')
 
         all_hosts = chain(cisco_hosts, juniper_hosts)  # read about itertools.chain
 
+        if len(sys.argv) > 2:
+            vendor = sys.argv[2]
+            if vendor not in configurator.VENDORS:
+                raise SystemExit(f'Unsupported vendor {vendor}')
+            all_hosts = [host for host in all_hosts if host.device_type.manufacturer.name.lower() == vendor]
+
         username = USERNAME or input('Username: ')
         password = PASSWORD or getpass.getpass('Password: ')
 
-        for host in all_hosts:
-            configure_acl(host, get_networks(), username, password)
+        # Target set is read once for the whole fleet
+        networks = get_networks()
+
+        fleet = FleetExecutor(workers=FLEET_WORKERS, vendor_limits=FLEET_VENDOR_LIMITS)
+        task = partial(
+            configure_acl, ips=networks, username=username, password=password, skip_unchanged=SKIP_CONFIGURED
+        )
+        results = fleet.run(all_hosts, task)
+
+        print(summary(results))
+        logger.info(f'Device sessions: {configurator.session_pool.stats}')
@@ -1,20 +1,37 @@
 import csv
-import time
+import json
+import os
+import sys
 from datetime import datetime
-from typing import Optional
+from itertools import islice
+from typing import Iterable, Iterator, Optional
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, select
 from tqdm import tqdm
 
-from resolver import DNSConnectionError
+from resolver import DNSConnectionError, configure_pool, resolve_stream
+from resolver.cache import DNSCache
 from webapp import app
 from webapp.models import db, Resource
+from webapp.settings import (
+    RESOLVE_CONCURRENCY,
+    RESOLVE_TIMEOUT,
+    DNS_NAMESERVERS,
+    DNS_RATE,
+    DNS_MAX_RATE,
+    DNS_CACHE_FILE,
+)
 
 """
-Разовый импорт данных из csv в DB и резолвом ресурсов
+Импорт данных из csv в DB и резолвом ресурсов.
+Файл читается пачками по IMPORT_BATCH_SIZE строк, после каждой пачки пишется checkpoint,
+прерванный импорт того же файла продолжается с места остановки:
+python import_data.py [filename.csv]
 """
 
 FILE_NAME = 'filename.csv'
+# Строк csv в одной пачке
+IMPORT_BATCH_SIZE = 500
 
 
 # Преобразовать дату к правильному виду yyyy-mm-dd
@@ -114,9 +131,8 @@ def get_date(data: str) -> Optional[datetime]:
     return parse_date(data)
 
 
-with open(FILE_NAME, 'r', encoding='utf-8') as f:
-    reader = csv.DictReader(f, delimiter=';')
-    resources = []
+def read_resources(reader: Iterable[dict]) -> Iterator[dict]:
+    """ Ресурсы из строк csv, в одной строке может быть несколько ресурсов """
     for row in reader:
 
         # IPs with domain name isn't interesting
@@ -131,42 +147,160 @@ with open(FILE_NAME, 'r', encoding='utf-8') as f:
         resource_type = row['resource_type']
 
         for domain in domains:
-            r = Resource()
-            r.name = domain
-            r.description = description
-            r.added_date = added_date
-            r.order = order
-            r.resource_type = resource_type
-
-            resources.append(r)
-
-already_exists = []
-added_resources = []
-
-with app.app_context():
-    for resource in tqdm(resources):
-        db.session.add(resource)
-
-        try:
-            db.session.commit()
-        except IntegrityError:
-            already_exists.append(resource)
-            db.session.rollback()
-            continue
-
-        for _ in range(2):
-            try:
-                resource.update_ips()
-            except DNSConnectionError:
-                print(resource.name)
-                print('DNS is unreachable. RETRYING...')
-                time.sleep(0.3)
+            if not domain:
+                continue
+            yield {
+                'name': domain,
+                'description': description,
+                'added_date': added_date,
+                'order': order,
+                'resource_type': resource_type,
+                'status': Resource.STATUS_ERROR,
+            }
+
+
+def import_batch(resources: list, dns_cache: DNSCache) -> (int, list, list):
+    """
+    Добавить новые ресурсы одной пачкой и отрезолвить их.
+    Возвращает количество добавленных, уже существующие имена и имена, для которых DNS недоступен.
+    """
+    # Повтор имени в файле - тоже уже существующий ресурс
+    unique = {}
+    already_exists = []
+    for resource in resources:
+        if resource['name'] in unique:
+            already_exists.append(resource['name'])
+        else:
+            unique[resource['name']] = resource
+
+    existing = set(db.session.execute(select(Resource.name).where(Resource.name.in_(unique))).scalars())
+    already_exists.extend(name for name in unique if name in existing)
+    new = [resource for name, resource in unique.items() if name not in existing]
+
+    if not new:
+        return 0, already_exists, []
+
+    db.session.execute(insert(Resource), new)
+    db.session.commit()
+
+    ids = dict(db.session.execute(
+        select(Resource.name, Resource.id).where(Resource.name.in_([resource['name'] for resource in new]))
+    ).all())
+
+    # resource id -> resolved ips, None for DNS connection error
+    resolved = {}
+    ttls = {}
+    domains = {}
+    for name, resource_id in ids.items():
+        resource = Resource(name=name)
+        if resource.is_address():
+            resolved[resource_id] = resource.get_resolved_ips()
+        else:
+            domains[name] = resource_id
+
+    failed = []
+    try:
+        for result in resolve_stream(
+                domains, concurrency=RESOLVE_CONCURRENCY, timeout=RESOLVE_TIMEOUT, cache=dns_cache,
+        ):
+            if isinstance(result.error, DNSConnectionError):
+                failed.append(result.domain)
+                resolved[domains[result.domain]] = None
             else:
-                resource.status = Resource.STATUS_RESOLVED
-                added_resources.append(resource)
+                resolved[domains[result.domain]] = set(result.ips)
+                ttls[domains[result.domain]] = result.ttl
+    except Exception as e:
+        # Ресурсы уже добавлены, неотрезолвленные остаются с ошибкой и не прерывают импорт
+        print(f'Resolve failed: {e!r}')
+        for name, resource_id in domains.items():
+            if resource_id not in resolved:
+                failed.append(name)
+                resolved[resource_id] = None
+
+    # Ресурсы с ошибкой DNS повторит resolve_resources.py
+    Resource.sync_ips(resolved, ttls)
+
+    return len(new), already_exists, failed
+
+
+def checkpoint_path(file_name: str) -> str:
+    return f'{file_name}.checkpoint'
+
+
+def load_checkpoint(file_name: str) -> dict:
+    """ Сколько строк файла уже импортировано, если файл не менялся с прошлого запуска """
+    stat = os.stat(file_name)
+    try:
+        with open(checkpoint_path(file_name), 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != stat.st_mtime_ns:
+        return {}
+    return checkpoint
+
+
+def save_checkpoint(file_name: str, checkpoint: dict):
+    stat = os.stat(file_name)
+    checkpoint.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+
+    tmp_path = f'{checkpoint_path(file_name)}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path(file_name))
+
+
+def import_file(file_name: str):
+    checkpoint = load_checkpoint(file_name)
+    done_rows = checkpoint.get('rows', 0)
+    added = checkpoint.get('added', 0)
+    exists = checkpoint.get('exists', 0)
+    if done_rows:
+        print(f'Resuming after {done_rows} rows')
+
+    dns_cache = DNSCache(DNS_CACHE_FILE)
+    configure_pool(nameservers=DNS_NAMESERVERS, rate=DNS_RATE, max_rate=DNS_MAX_RATE)
+    failed = []
+
+    with open(file_name, 'r', encoding='utf-8') as f, app.app_context():
+        reader = csv.DictReader(f, delimiter=';')
+        rows = tqdm(reader, initial=done_rows, unit='rows')
+        # Строки, импортированные в прошлый раз, только читаются
+        for _ in islice(rows, done_rows):
+            pass
+
+        while True:
+            batch = list(islice(rows, IMPORT_BATCH_SIZE))
+            if not batch:
                 break
 
-print(f'Added: {len(added_resources)}')
-print(f'Already exists: {len(already_exists)}')
-for _ in already_exists:
-    print(_.name)
+            batch_added, batch_exists, batch_failed = import_batch(list(read_resources(batch)), dns_cache)
+            added += batch_added
+            exists += len(batch_exists)
+            failed.extend(batch_failed)
+            for name in batch_exists:
+                rows.write(f'Already exists: {name}')
+
+            done_rows += len(batch)
+            save_checkpoint(file_name, {'rows': done_rows, 'added': added, 'exists': exists})
+
+    dns_cache.evict()
+    dns_cache.close()
+    # Пустой файл не оставляет checkpoint
+    try:
+        os.remove(checkpoint_path(file_name))
+    except FileNotFoundError:
+        pass
+
+    if failed:
+        print('DNS is unreachable, will be resolved by resolve_resources.py:')
+        for name in failed:
+            print(name)
+
+    print(f'Added: {added}')
+    print(f'Already exists: {exists}')
+
+
+if __name__ == '__main__':
+    import_file(sys.argv[1] if len(sys.argv) > 1 else FILE_NAME)
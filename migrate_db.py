@@ -0,0 +1,74 @@
+"""
+Adds columns and indexes of newer versions to an existing DB, create_db.py only creates missing tables.
+Safe to run many times.
+"""
+from loguru import logger
+from sqlalchemy import inspect, text
+
+from webapp import app
+from webapp.models import db, IP_VERSION_DDL, RESOURCE_FTS_DDL, RESOURCE_FTS_REBUILD
+
+# table -> [(column, DDL, statement filling the column when it is added)]
+COLUMNS = {
+    'resource': [
+        ('next_resolve_time', 'DATETIME', None),
+        ('fail_count', 'INTEGER NOT NULL DEFAULT 0', None),
+        (
+            'ip_count',
+            'INTEGER NOT NULL DEFAULT 0',
+            'UPDATE resource SET ip_count = (SELECT count(*) FROM ip WHERE ip.resource_id = resource.id)',
+        ),
+    ],
+}
+
+# table -> statements creating it and filling it from existing rows
+TABLES = {
+    'resource_fts': RESOURCE_FTS_DDL + [RESOURCE_FTS_REBUILD],
+}
+
+# Indexes, triggers and rows added after the tables were created
+STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS ix_resource_next_resolve_time ON resource (next_resolve_time)',
+    'CREATE INDEX IF NOT EXISTS ix_resource_resource_type ON resource (resource_type)',
+    'CREATE INDEX IF NOT EXISTS ix_resource_added_date ON resource (added_date)',
+    # Duplicates left by older versions would fail the unique index
+    'DELETE FROM ip WHERE id NOT IN (SELECT min(id) FROM ip GROUP BY resource_id, ip)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_ip_resource_ip ON ip (resource_id, ip)',
+    'CREATE INDEX IF NOT EXISTS ix_ip_ip ON ip (ip)',
+] + IP_VERSION_DDL
+
+
+def migrate():
+    db.create_all()
+    inspector = inspect(db.engine)
+
+    backfills = []
+
+    with db.engine.begin() as conn:
+        for table, columns in COLUMNS.items():
+            existing = {column['name'] for column in inspector.get_columns(table)}
+            for name, ddl, backfill in columns:
+                if name not in existing:
+                    logger.info(f'Adding {table}.{name}')
+                    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+                    if backfill:
+                        backfills.append(backfill)
+
+        existing_tables = set(inspector.get_table_names())
+        for table, statements in TABLES.items():
+            if table not in existing_tables:
+                logger.info(f'Creating {table}')
+                for statement in statements:
+                    conn.execute(text(statement))
+
+        for ddl in STATEMENTS:
+            conn.execute(text(ddl))
+
+        # After duplicates are gone
+        for statement in backfills:
+            conn.execute(text(statement))
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        migrate()
@@ -3,6 +3,13 @@ from pynetbox.core.api import Api
 from pynetbox.core.query import RequestError
 from pynetbox.models.dcim import Devices
 from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
 
 
 class NBException(Exception):
@@ -16,7 +23,7 @@ class TimeoutHTTPAdapter(HTTPAdapter):
     """
 
     def __init__(self, *args, **kwargs):
-        self.timeout = kwargs.get('timeout', 5)
+        self.timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
         super().__init__(*args, **kwargs)
 
     def send(self, request, **kwargs):
@@ -25,13 +32,45 @@ class TimeoutHTTPAdapter(HTTPAdapter):
 
 
 class NetboxClient(Api):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    """
+    pool_size - keep-alive connections per host, should be not less than parallel page requests.
+    retries - GET requests are retried with exponential backoff on connect errors and 5xx.
+    parallel - after the first page, the rest of list query pages are fetched concurrently.
+    """
+
+    def __init__(
+            self,
+            *args,
+            timeout: float = DEFAULT_TIMEOUT,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            retries: int = DEFAULT_RETRIES,
+            backoff_factor: float = DEFAULT_BACKOFF,
+            parallel: bool = False,
+            **kwargs,
+    ):
+        super().__init__(*args, threading=parallel, **kwargs)
 
-        adapter = TimeoutHTTPAdapter()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET'}),
+            # Last response goes to pynetbox, it raises RequestError
+            raise_on_status=False,
+        )
+        adapter = TimeoutHTTPAdapter(
+            timeout=timeout,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
         session = requests.Session()
         session.mount('http://', adapter)
         session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
 
         self.http_session = session
 
@@ -44,3 +83,14 @@ class NetboxClient(Api):
             raise NBException(f'Unable to connect to Netbox: {self.base_url}') from None
         except RequestError as e:
             raise NBException(e) from None
+
+    def get_devices(self, **filters) -> list[Devices]:
+        """ All pages of dcim.devices.filter, list values (name=[...]) are sent in one query """
+        try:
+            return list(self.dcim.devices.filter(**filters))
+        except requests.exceptions.ConnectTimeout:
+            raise NBException(f'Netbox connection timeout: {self.base_url}') from None
+        except requests.exceptions.ConnectionError:
+            raise NBException(f'Unable to connect to Netbox: {self.base_url}') from None
+        except RequestError as e:
+            raise NBException(e) from None
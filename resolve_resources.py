@@ -1,11 +1,25 @@
-from time import sleep
+import argparse
+import signal
 
 from loguru import logger
-from tqdm import tqdm
 
+from resolver import configure_pool
+from resolver.cache import DNSCache
 from webapp import app
-from webapp.models import Resource, DNSResolveError, DNSConnectionError
-from webapp.settings import LOG_FILE, LOG_LEVEL
+from webapp.scheduler import ResolveScheduler
+from webapp.settings import (
+    LOG_FILE,
+    LOG_LEVEL,
+    RESOLVE_CONCURRENCY,
+    RESOLVE_TIMEOUT,
+    RESOLVE_RATE,
+    RESOLVE_BATCH,
+    RESOLVE_BUDGET,
+    DNS_NAMESERVERS,
+    DNS_RATE,
+    DNS_MAX_RATE,
+    DNS_CACHE_FILE,
+)
 
 logger.add(
     LOG_FILE,
@@ -18,17 +32,33 @@ logger.add(
 
 app = app
 
-failed_resources = []
 
-with app.app_context():
-    resources = Resource.query.all()
-    for resource in tqdm(resources):
-        try:
-            resource.update_ips()
-        except (DNSResolveError, DNSConnectionError):
-            failed_resources.append(resource)
-        sleep(0.3)
+def main():
+    parser = argparse.ArgumentParser(description='Keep resources resolved, the most overdue first')
+    parser.add_argument('--once', action='store_true', help='exit when nothing is due')
+    parser.add_argument('--budget', type=float, default=RESOLVE_BUDGET, help='max run time, seconds')
+    args = parser.parse_args()
+
+    dns_cache = DNSCache(DNS_CACHE_FILE)
+    dns_pool = configure_pool(nameservers=DNS_NAMESERVERS, rate=DNS_RATE, max_rate=DNS_MAX_RATE)
+
+    scheduler = ResolveScheduler(
+        cache=dns_cache,
+        rate=RESOLVE_RATE,
+        batch_size=RESOLVE_BATCH,
+        concurrency=RESOLVE_CONCURRENCY,
+        timeout=RESOLVE_TIMEOUT,
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: scheduler.stop())
+
+    with app.app_context():
+        stats = scheduler.run(budget=args.budget or None, once=args.once)
+
+    logger.info(f'DNS cache: {dns_cache.stats}')
+    logger.info(f'DNS nameservers: {dns_pool.stats}')
+    logger.info(f'Resolved {stats.resolved}, failed {stats.failed}, IPs added: {stats.added}, deleted: {stats.deleted}')
+
 
-    logger.info(f'FAILED TO RESOLVE {len(failed_resources)} RESOURCES: ')
-    for resource in failed_resources:
-        logger.info(resource.name)
+if __name__ == '__main__':
+    main()
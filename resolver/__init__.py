@@ -1,8 +1,22 @@
-from typing import Iterable
+import asyncio
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable, Iterator, Optional
 
-from dns import resolver, exception
+from dns import exception, resolver
 from tqdm import tqdm
 
+from resolver.cache import DNSCache
+from resolver.pool import NoAnswerError, ResolverPool, ServerError
+
+DEFAULT_CONCURRENCY = 50
+DEFAULT_TIMEOUT = 5.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
 
 class DNSConnectionError(Exception):
     """ For bad DNS connection """
@@ -12,38 +26,194 @@ class DNSResolveError(Exception):
     """ No domain name in answer from DNS """
 
 
-def resolve_domain(domain: str) -> list:
+@dataclass
+class ResolveResult:
+    """
+    Result of one domain resolution.
+    error is None, DNSResolveError (NXDOMAIN/NoAnswer) or DNSConnectionError (transport error).
+    """
+    domain: str
+    ips: list = field(default_factory=list)
+    error: Optional[Exception] = None
+    ttl: float = 0
+    cached: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _from_cache(cache: DNSCache, domain: str) -> Optional[ResolveResult]:
+    entry = cache.get(domain)
+    if entry is None:
+        return None
+    if entry.negative:
+        return ResolveResult(domain, error=DNSResolveError(domain), cached=True)
+    return ResolveResult(domain, ips=entry.ips, ttl=entry.expires - time.time(), cached=True)
+
+
+def _to_cache(cache: DNSCache, result: ResolveResult):
+    if result.ok:
+        cache.put(result.domain, result.ips, result.ttl)
+    elif isinstance(result.error, DNSResolveError):
+        cache.put_negative(result.domain)
+
+
+def configure_pool(**kwargs) -> ResolverPool:
+    """ Replace shared resolver pool, kwargs are passed to ResolverPool """
+    global _pool
     try:
-        dns_resolver = resolver.Resolver()
+        _pool = ResolverPool(**kwargs)
     except resolver.NoResolverConfiguration:
         raise DNSConnectionError from None
+    return _pool
+
+
+def get_pool() -> ResolverPool:
+    with _pool_lock:
+        if _pool is None:
+            configure_pool()
+    return _pool
+
+
+def resolve_domain(domain: str, cache: Optional[DNSCache] = None) -> list:
+    if cache is not None:
+        result = _from_cache(cache, domain)
+        if result is not None:
+            if result.error:
+                raise DNSResolveError
+            return result.ips
 
     try:
-        dns_answer = dns_resolver.resolve(domain)
+        resolved_ips, ttl = get_pool().resolve(domain)
 
-    except (
-            resolver.NXDOMAIN,  # The DNS query name does not exist. No RR for domain
-            resolver.NoAnswer,  # The DNS response does not contain an answer to the question. No RRSets for domain
-    ):
+    except NoAnswerError:  # NXDOMAIN, or no RRSets for domain
+        if cache is not None:
+            cache.put_negative(domain)
         raise DNSResolveError from None
 
-    except (
-            resolver.NoNameservers, # All nameservers failed to answer the query.
-            exception.DNSException,
-    ):
+    except (ServerError, exception.DNSException):  # All nameservers failed to answer the query.
         raise DNSConnectionError from None
 
-    resolved_ips = [x.address for x in dns_answer]
+    if cache is not None:
+        cache.put(domain, resolved_ips, ttl)
     return resolved_ips
 
 
-def resolve_domains(domains: Iterable) -> (list, list):
+async def _resolve_one(pool: ResolverPool, domain: str, timeout: float) -> ResolveResult:
+    try:
+        ips, ttl = await pool.resolve_async(domain, timeout)
+    except NoAnswerError:
+        return ResolveResult(domain, error=DNSResolveError(domain))
+    except (ServerError, exception.DNSException):
+        return ResolveResult(domain, error=DNSConnectionError(domain))
+
+    return ResolveResult(domain, ips=ips, ttl=ttl)
+
+
+async def resolve_domains_async(
+        domains: Iterable,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[DNSCache] = None,
+) -> AsyncIterator[ResolveResult]:
+    """
+    Resolve domains with at most `concurrency` queries in flight through the shared resolver pool.
+    Results are yielded in completion order, not in input order.
+    With cache only expired names are queried, the rest is answered from cache.
+    """
+    pool = get_pool()
+    domains = iter(domains)
+    results = asyncio.Queue()
+
+    async def worker():
+        try:
+            for domain in domains:
+                result = _from_cache(cache, domain) if cache is not None else None
+                if result is None:
+                    result = await _resolve_one(pool, domain, timeout)
+                    if cache is not None:
+                        _to_cache(cache, result)
+                await results.put(result)
+        finally:
+            results.put_nowait(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+    running = len(workers)
+
+    try:
+        while running:
+            result = await results.get()
+            if result is None:
+                running -= 1
+                continue
+            yield result
+
+        # Reraise unexpected worker errors
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
+
+
+def resolve_stream(
+        domains: Iterable,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[DNSCache] = None,
+) -> Iterator[ResolveResult]:
+    """
+    Synchronous wrapper over resolve_domains_async.
+    Event loop runs in a background thread, so queries stay in flight while the caller handles results.
+    """
+    domains = list(domains)
+    results = queue.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    async def pump():
+        async for result in resolve_domains_async(domains, concurrency, timeout, cache):
+            if stopped.is_set():
+                break
+            results.put(result)
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=run, name='resolve-stream', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def resolve_domains(
+        domains: Iterable,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[DNSCache] = None,
+) -> (list, list):
     resolved_ips = set()
     unresolved_domains = set()
 
-    for domain in tqdm(domains):
-        ips = resolve_domain(domain)
-        if ips:
-            resolved_ips.update(ips)
-        unresolved_domains.add(domain)
+    domains = list(domains)
+
+    for result in tqdm(resolve_stream(domains, concurrency, timeout, cache), total=len(domains)):
+        if result.ips:
+            resolved_ips.update(result.ips)
+        else:
+            unresolved_domains.add(result.domain)
     return list(resolved_ips), list(unresolved_domains)
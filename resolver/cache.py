@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_TTL = 86400
+DEFAULT_NEGATIVE_TTL = 300
+DEFAULT_NEGATIVE_TTL_MAX = 86400
+
+
+@dataclass
+class CacheEntry:
+    name: str
+    ips: list
+    negative: bool
+    expires: float
+
+
+class DNSCache:
+    """
+    Persistent SQLite cache of DNS answers keyed by name.
+    Positive answers live until their TTL expires, NXDOMAIN/NoAnswer are cached
+    with exponential backoff capped by negative_ttl_max.
+    When the cache grows over max_entries, least recently used names are evicted.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            max_entries: int = DEFAULT_MAX_ENTRIES,
+            max_ttl: int = DEFAULT_MAX_TTL,
+            negative_ttl: int = DEFAULT_NEGATIVE_TTL,
+            negative_ttl_max: int = DEFAULT_NEGATIVE_TTL_MAX,
+    ):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.negative_ttl_max = negative_ttl_max
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS dns_cache ('
+            'name TEXT PRIMARY KEY, '
+            'ips TEXT NOT NULL, '
+            'negative INTEGER NOT NULL, '
+            'failures INTEGER NOT NULL DEFAULT 0, '
+            'expires REAL NOT NULL, '
+            'accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS dns_cache_accessed ON dns_cache (accessed)')
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def get(self, name: str) -> Optional[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT ips, negative, expires FROM dns_cache WHERE name = ?', (name,)
+            ).fetchone()
+
+            if row is None or row[2] <= now:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute('UPDATE dns_cache SET accessed = ? WHERE name = ?', (now, name))
+
+        ips, negative, expires = row
+        return CacheEntry(name, json.loads(ips), bool(negative), expires)
+
+    def put(self, name: str, ips: list, ttl: float):
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO dns_cache (name, ips, negative, failures, expires, accessed) '
+                'VALUES (?, ?, 0, 0, ?, ?)',
+                (name, json.dumps(ips), now + ttl, now),
+            )
+
+    def put_negative(self, name: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT failures FROM dns_cache WHERE name = ? AND negative = 1', (name,)
+            ).fetchone()
+            failures = row[0] + 1 if row else 1
+            ttl = min(self.negative_ttl * 2 ** (failures - 1), self.negative_ttl_max)
+
+            self._conn.execute(
+                'INSERT OR REPLACE INTO dns_cache (name, ips, negative, failures, expires, accessed) '
+                'VALUES (?, ?, 1, ?, ?, ?)',
+                (name, '[]', failures, now + ttl, now),
+            )
+
+    def invalidate(self, name: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM dns_cache WHERE name = ?', (name,))
+
+    def evict(self) -> int:
+        """
+        Drop least recently used entries over max_entries.
+        Expired entries are kept while there is room: negative backoff depends on their failure counter.
+        """
+        with self._lock:
+            count = self._conn.execute('SELECT count(*) FROM dns_cache').fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+
+            self._conn.execute(
+                'DELETE FROM dns_cache WHERE name IN '
+                '(SELECT name FROM dns_cache ORDER BY accessed LIMIT ?)',
+                (overflow,),
+            )
+            self.evictions += overflow
+        return overflow
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import dns.asyncquery
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+from dns import exception, resolver
+
+DEFAULT_RATE = 50
+DEFAULT_MIN_RATE = 2
+DEFAULT_MAX_RATE = 500
+DEFAULT_TIMEOUT = 2.0
+
+# Rate is adjusted once per ADJUST_WINDOW answers of a nameserver
+ADJUST_WINDOW = 20
+FAILURE_THRESHOLD = 0.05
+RATE_DECREASE = 0.7
+RATE_INCREASE = 1.1
+
+
+class NoAnswerError(Exception):
+    """ NXDOMAIN or no A records in answer """
+
+
+class ServerError(Exception):
+    """ Nameserver failed to answer: timeout, SERVFAIL, REFUSED, broken answer """
+
+
+def make_query(domain: str) -> dns.message.Message:
+    """ A query for domain, names which can not be in DNS (empty or too long labels) raise NoAnswerError """
+    try:
+        return dns.message.make_query(domain, dns.rdatatype.A)
+    except exception.DNSException:
+        raise NoAnswerError from None
+
+
+class TokenBucket:
+    """
+    Token bucket with adaptive rate.
+    Rate goes down when the failure ratio over the last window is above FAILURE_THRESHOLD
+    and slowly goes up while the nameserver answers without failures.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = max(rate / 10, 1)
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._successes = 0
+        self._failures = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+
+    def delay(self) -> float:
+        """ Seconds to wait until a token is available """
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def reserve(self) -> float:
+        """ Take a token (possibly in advance) and return seconds to wait before using it """
+        wait = self.delay()
+        self._tokens -= 1
+        return wait
+
+    def feedback(self, failed: bool):
+        if failed:
+            self._failures += 1
+        else:
+            self._successes += 1
+
+        total = self._successes + self._failures
+        if total < ADJUST_WINDOW:
+            return
+
+        if self._failures / total > FAILURE_THRESHOLD:
+            self.rate = max(self.rate * RATE_DECREASE, self.min_rate)
+        elif not self._failures:
+            self.rate = min(self.rate * RATE_INCREASE, self.max_rate)
+
+        self.burst = max(self.rate / 10, 1)
+        self._successes = 0
+        self._failures = 0
+
+
+class Nameserver:
+    def __init__(self, address: str, bucket: TokenBucket):
+        self.address = address
+        self.bucket = bucket
+
+        self.queries = 0
+        self.servfails = 0
+        self.timeouts = 0
+        self.truncated = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'rate': round(self.bucket.rate, 1),
+            'queries': self.queries,
+            'servfails': self.servfails,
+            'timeouts': self.timeouts,
+            'truncated': self.truncated,
+        }
+
+
+class ResolverPool:
+    """
+    Long-lived resolver which spreads queries over a pool of recursive nameservers.
+    Every nameserver has its own adaptive token bucket, truncated UDP answers are retried over TCP.
+    Safe to share between threads and event loops.
+    """
+
+    def __init__(
+            self,
+            nameservers: Optional[list] = None,
+            rate: float = DEFAULT_RATE,
+            min_rate: float = DEFAULT_MIN_RATE,
+            max_rate: float = DEFAULT_MAX_RATE,
+            timeout: float = DEFAULT_TIMEOUT,
+            port: int = 53,
+    ):
+        if not nameservers:
+            # resolv.conf is parsed only once per pool
+            nameservers = resolver.Resolver().nameservers
+
+        self.nameservers = [Nameserver(ns, TokenBucket(rate, min_rate, max_rate)) for ns in nameservers]
+        self.timeout = timeout
+        self.port = port
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        return {ns.address: ns.stats for ns in self.nameservers}
+
+    def _pick(self, tried: set) -> (Nameserver, float):
+        with self._lock:
+            candidates = [ns for ns in self.nameservers if ns not in tried]
+            ns = min(candidates, key=lambda n: n.bucket.delay())
+            ns.queries += 1
+            return ns, ns.bucket.reserve()
+
+    def _feedback(self, ns: Nameserver, failed: bool):
+        with self._lock:
+            ns.bucket.feedback(failed)
+
+    def _parse(self, ns: Nameserver, response: dns.message.Message) -> (list, float):
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            raise NoAnswerError
+        if rcode != dns.rcode.NOERROR:
+            ns.servfails += 1
+            raise ServerError(dns.rcode.to_text(rcode))
+
+        ips = []
+        ttl = None
+        for rrset in response.answer:
+            # CNAME chain shortens lifetime of the whole answer
+            ttl = rrset.ttl if ttl is None else min(ttl, rrset.ttl)
+            if rrset.rdtype == dns.rdatatype.A:
+                ips.extend(rr.address for rr in rrset)
+
+        if not ips:
+            raise NoAnswerError
+        return ips, ttl
+
+    def resolve(self, domain: str, timeout: Optional[float] = None) -> (list, float):
+        """
+        Resolve A records of domain, returns ips and ttl.
+        Raises NoAnswerError for NXDOMAIN/NoAnswer or a malformed name and ServerError when all nameservers failed.
+        """
+        timeout = timeout or self.timeout
+        query = make_query(domain)
+        tried = set()
+        error = None
+
+        while len(tried) < len(self.nameservers):
+            ns, wait = self._pick(tried)
+            tried.add(ns)
+            if wait:
+                time.sleep(wait)
+
+            try:
+                response = dns.query.udp(query, ns.address, timeout=timeout, port=self.port)
+                if response.flags & dns.flags.TC:
+                    ns.truncated += 1
+                    response = dns.query.tcp(query, ns.address, timeout=timeout, port=self.port)
+                result = self._parse(ns, response)
+            except NoAnswerError:
+                self._feedback(ns, failed=False)
+                raise
+            except ServerError as e:
+                error = e
+            except exception.Timeout as e:
+                ns.timeouts += 1
+                error = ServerError(e)
+            except (exception.DNSException, OSError) as e:
+                error = ServerError(e)
+            else:
+                self._feedback(ns, failed=False)
+                return result
+
+            self._feedback(ns, failed=True)
+
+        raise error
+
+    async def resolve_async(self, domain: str, timeout: Optional[float] = None) -> (list, float):
+        """ Same as resolve() for asyncio """
+        timeout = timeout or self.timeout
+        query = make_query(domain)
+        tried = set()
+        error = None
+
+        while len(tried) < len(self.nameservers):
+            ns, wait = self._pick(tried)
+            tried.add(ns)
+            if wait:
+                await asyncio.sleep(wait)
+
+            try:
+                response = await dns.asyncquery.udp(query, ns.address, timeout=timeout, port=self.port)
+                if response.flags & dns.flags.TC:
+                    ns.truncated += 1
+                    response = await dns.asyncquery.tcp(query, ns.address, timeout=timeout, port=self.port)
+                result = self._parse(ns, response)
+            except NoAnswerError:
+                self._feedback(ns, failed=False)
+                raise
+            except ServerError as e:
+                error = e
+            except exception.Timeout as e:
+                ns.timeouts += 1
+                error = ServerError(e)
+            except (exception.DNSException, OSError) as e:
+                error = ServerError(e)
+            else:
+                self._feedback(ns, failed=False)
+                return result
+
+            self._feedback(ns, failed=True)
+
+        raise error
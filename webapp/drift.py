@@ -0,0 +1,110 @@
+import threading
+from datetime import datetime
+from typing import Optional
+
+import configurator
+from configurator.fleet import FleetExecutor, DeviceResult, FLEET_NOACL, FLEET_UPTODATE
+from configurator.ipset import IPSet
+
+DRIFT_FOUND = 'drift'
+
+
+def classify_diff(diff: dict) -> str:
+    if diff['status'] == configurator.Status.UPTODATE:
+        return FLEET_UPTODATE
+    if diff['status'] == configurator.Status.NOACL:
+        return FLEET_NOACL
+    return DRIFT_FOUND
+
+
+class DriftSweeper:
+    """
+    Runs configurator.get_diff against all devices in background.
+    Last result of every device is kept with its timestamp until the next sweep replaces it.
+    """
+
+    def __init__(self, workers: int, vendor_limits: Optional[dict] = None):
+        self.executor = FleetExecutor(workers=workers, vendor_limits=vendor_limits)
+        self.started_at = None
+        self.finished_at = None
+
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def results(self) -> dict:
+        with self._lock:
+            return dict(self._results)
+
+    def _store(self, device: DeviceResult):
+        diff = device.result or {}
+        with self._lock:
+            self._results[device.name] = {
+                'status': device.status,
+                'to_add': len(diff.get('to_add', [])),
+                'to_delete': len(diff.get('to_delete', [])),
+                'duration': device.duration,
+                'error': device.error,
+                'cached': diff.get('cached', False),
+                'checked_at': datetime.now(),
+            }
+
+    def _sweep(
+            self,
+            hosts: list,
+            resolved_ips: IPSet,
+            username: str,
+            password: str,
+            optimize: bool,
+            use_cached: bool,
+    ):
+        # Aggregated once for all devices instead of in every get_diff
+        if optimize:
+            resolved_ips, _ = configurator.optimize_ips(resolved_ips)
+
+        def task(host):
+            return configurator.get_diff(
+                host=host.primary_ip.address.split('/')[0],
+                vendor=host.device_type.manufacturer.name.lower(),
+                resolved_ips=resolved_ips,
+                username=username,
+                password=password,
+                use_cached=use_cached,
+            )
+
+        try:
+            self.executor.run(hosts, task, on_result=self._store, classifier=classify_diff)
+        finally:
+            self.finished_at = datetime.now()
+
+    def start(
+            self,
+            hosts: list,
+            resolved_ips: IPSet,
+            username: str,
+            password: str,
+            optimize: bool = False,
+            use_cached: bool = False,
+    ) -> bool:
+        """
+        False if previous sweep is still running.
+        With use_cached devices are compared with their last known state, only devices without one are read.
+        """
+        with self._lock:
+            if self.running:
+                return False
+
+            self.started_at = datetime.now()
+            self.finished_at = None
+            self._thread = threading.Thread(
+                target=self._sweep,
+                args=(list(hosts), resolved_ips, username, password, optimize, use_cached),
+                name='drift-sweep',
+                daemon=True,
+            )
+            self._thread.start()
+        return True
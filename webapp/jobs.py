@@ -0,0 +1,134 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+EVENT_STATUS = 'status'
+EVENT_PROGRESS = 'progress'
+EVENT_MESSAGE = 'message'
+
+DEFAULT_WORKERS = 4
+DEFAULT_HISTORY = 100
+
+
+@dataclass
+class Job:
+    id: str
+    device: str
+    action: str
+    status: str = JOB_QUEUED
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    done: int = 0
+    total: int = 0
+    result: Any = None
+    error: Optional[Exception] = None
+    events: list = field(default_factory=list)
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def emit(self, event: str, data: dict):
+        with self._cond:
+            self.events.append((len(self.events) + 1, event, data))
+            self._cond.notify_all()
+
+    def set_status(self, status: str):
+        # Under the same lock as events, so a reader never sees a finished job without its last event
+        with self._cond:
+            self.status = status
+            self.events.append((len(self.events) + 1, EVENT_STATUS, {'status': status}))
+            self._cond.notify_all()
+
+    def message(self, text: str):
+        self.emit(EVENT_MESSAGE, {'text': text, 'time': datetime.now().strftime('%H:%M:%S')})
+
+    def progress(self, done: int, total: int):
+        self.done = done
+        self.total = total
+        self.emit(EVENT_PROGRESS, {'done': done, 'total': total})
+
+    def wait_events(self, after: int, timeout: float) -> list:
+        """ Events with sequence number greater than after, waits up to timeout for new ones """
+        with self._cond:
+            if len(self.events) <= after and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[after:]
+
+
+class JobRunner:
+    """
+    Runs device actions in a thread pool, outside of the request that started them.
+    One device has at most one unfinished job: submitting another one returns the running job.
+    Last `history` jobs are kept for their pages and event streams.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, history: int = DEFAULT_HISTORY):
+        self.history = history
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, device: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(self._active.get(device))
+
+    def submit(self, device: str, action: str, task: Callable) -> (Job, bool):
+        """ task(job) returns job result. False if a job for the device is already running """
+        with self._lock:
+            running = self._jobs.get(self._active.get(device))
+            if running is not None and not running.finished:
+                return running, False
+
+            job = Job(id=uuid.uuid4().hex[:12], device=device, action=action)
+            self._jobs[job.id] = job
+            self._active[device] = job.id
+            self._prune()
+
+        self._pool.submit(self._run, job, task)
+        return job, True
+
+    def _prune(self):
+        """ Must be called with lock """
+        while len(self._jobs) > self.history:
+            job_id, job = next(iter(self._jobs.items()))
+            if not job.finished:
+                break
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, task: Callable):
+        job.started_at = datetime.now()
+        job.set_status(JOB_RUNNING)
+        started = time.monotonic()
+
+        try:
+            job.result = task(job)
+        except Exception as e:
+            logger.exception(e)
+            job.error = e
+            status = JOB_FAILED
+        else:
+            status = JOB_DONE
+
+        job.finished_at = datetime.now()
+        logger.info(f'Job {job.action} on {job.device}: {status} in {time.monotonic() - started:.1f}s')
+        job.set_status(status)
@@ -1,12 +1,30 @@
 import re
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, column, delete, event, insert, select, table, text, true
 
 from resolver import resolve_domain, DNSResolveError, DNSConnectionError
 
 db = SQLAlchemy()
 
+IP_PATTERN = r'\d{1,}\.\d{1,}\.\d{1,}\.\d{1,}'
+
+# Full text index over resource text fields, see RESOURCE_FTS_DDL
+resource_fts = table('resource_fts', column('rowid'))
+
+# Resources per transaction in Resource.sync_ips
+SYNC_BATCH_SIZE = 500
+
+# Resolved resource is due again after its DNS TTL, kept within these bounds, seconds
+RESOLVE_INTERVAL_MIN = 300
+RESOLVE_INTERVAL_MAX = 86400
+# Failed resource is retried after RESOLVE_RETRY * 2 ** failures, up to RESOLVE_RETRY_MAX, seconds
+RESOLVE_RETRY = 60
+RESOLVE_RETRY_MAX = 3600
+
 
 class Resource(db.Model):
     __tablename__ = 'resource'
@@ -17,22 +35,42 @@ class Resource(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
     status = db.Column(db.String, nullable=False, default=STATUS_ERROR)
-    resource_type = db.Column(db.String, nullable=False)
+    resource_type = db.Column(db.String, nullable=False, index=True)
     description = db.Column(db.String, nullable=True, unique=False)
     order = db.Column(db.String, nullable=True, unique=False)
-    added_date = db.Column(db.Date(), nullable=True)
+    added_date = db.Column(db.Date(), nullable=True, index=True)
     resolve_time = db.Column(db.DateTime(timezone=True))
+    # When the resolve scheduler picks the resource next time, never resolved resources have NULL
+    next_resolve_time = db.Column(db.DateTime(timezone=True), index=True)
+    fail_count = db.Column(db.Integer, nullable=False, default=0)
+    # Number of IPs, kept by sync_ips so the resources list does not count them
+    ip_count = db.Column(db.Integer, nullable=False, default=0)
     ips = db.relationship('IP', cascade='all, delete')
 
     def __repr__(self):
         return f'<Resource {self.resource}>'
 
+    @classmethod
+    def matching(cls, search: str):
+        """
+        Condition for resources with every word of search as a word prefix in name, description or order,
+        answered by the resource_fts full text index
+        """
+        words = re.findall(r'[^\s"]+', search)
+        if not words:
+            return true()
+        query = ' '.join(f'"{word}"*' for word in words)
+        return cls.id.in_(
+            select(resource_fts.c.rowid).where(text('resource_fts MATCH :query').bindparams(query=query))
+        )
+
+    def is_address(self) -> bool:
+        return bool(re.match(IP_PATTERN, self.name))
+
     def get_resolved_ips(self) -> set:
         resolved = set()
 
-        ip_pattern = r'\d{1,}\.\d{1,}\.\d{1,}\.\d{1,}'
-
-        if re.match(ip_pattern, self.name):
+        if self.is_address():
             if self.name.endswith('/32'):
                 resolved.add(self.name[:-3])
             else:
@@ -45,56 +83,165 @@ class Resource(db.Model):
         return resolved
 
     def update_ips(self):
-        if self.ips:
-            resource_ips_db = IP.query.filter(IP.resource_id == self.id).all()
-            resource_ips = {ip.ip for ip in resource_ips_db}
-        else:
-            resource_ips = set()
-
-        self.resolve_time = datetime.now()
-
-        resolved_ips = set()
-
         try:
             resolved_ips = self.get_resolved_ips()
-
-        except DNSConnectionError:
-            self.status = self.STATUS_ERROR
-            db.session.commit()
-            raise
-
-        except DNSResolveError:
-            # Resource resolved, but have no RR or RRSets
-            self.status = self.STATUS_RESOLVED
-            IP.query.filter(IP.resource_id == self.id).delete()
-            db.session.commit()
-
+        except (DNSResolveError, DNSConnectionError) as e:
+            self.save_resolved(set(), e)
+            if isinstance(e, DNSConnectionError):
+                raise
         else:
-            self.status = self.STATUS_RESOLVED
-
-        if resolved_ips:
-            ips_to_add = resolved_ips - set(resource_ips)
-            ips_to_delete = set(resource_ips) - resolved_ips
-
-            for ip_to_delete in ips_to_delete:
-                IP.query.filter(IP.ip == ip_to_delete, IP.resource_id == self.id).delete()
-
-            for ip_to_add in ips_to_add:
-                ip = IP()
-                ip.ip = ip_to_add
-                ip.resource_id = self.id
-                db.session.add(ip)
+            self.save_resolved(resolved_ips)
+
+    def save_resolved(self, resolved_ips: set, error: Optional[Exception] = None):
+        if isinstance(error, DNSConnectionError):
+            resolved_ips = None
+        self.sync_ips({self.id: resolved_ips})
+
+    @staticmethod
+    def resolve_interval(ttl: Optional[float]) -> timedelta:
+        return timedelta(seconds=min(RESOLVE_INTERVAL_MAX, max(RESOLVE_INTERVAL_MIN, ttl or 0)))
+
+    @staticmethod
+    def retry_interval(fail_count: int) -> timedelta:
+        return timedelta(seconds=min(RESOLVE_RETRY_MAX, RESOLVE_RETRY * 2 ** min(fail_count, 16)))
+
+    @classmethod
+    def sync_ips(cls, resolved: dict, ttls: Optional[dict] = None) -> dict:
+        """
+        Bulk synchronisation of resolved IPs.
+        resolved maps resource id to set of resolved IPs, None means DNS connection error:
+        resource gets STATUS_ERROR, keeps its IPs and is retried with exponential backoff.
+        ttls maps resource id to DNS TTL of the answer, it sets when the resource is due again.
+        Returns resource id -> (added, deleted) counters.
+        """
+        counters = {}
+        now = datetime.now()
+        ttls = ttls or {}
+        resource_ids = list(resolved)
+
+        for start in range(0, len(resource_ids), SYNC_BATCH_SIZE):
+            batch = resource_ids[start:start + SYNC_BATCH_SIZE]
+
+            current = defaultdict(dict)
+            rows = db.session.execute(
+                select(IP.id, IP.resource_id, IP.ip).where(IP.resource_id.in_(batch))
+            )
+            for ip_id, resource_id, ip in rows:
+                current[resource_id][ip] = ip_id
+
+            fail_counts = dict(db.session.execute(
+                select(cls.id, cls.fail_count).where(cls.id.in_(batch))
+            ).all())
+
+            to_insert = []
+            to_delete = []
+            statuses = []
+
+            for resource_id in batch:
+                resolved_ips = resolved[resource_id]
+
+                if resolved_ips is None:
+                    fail_count = (fail_counts.get(resource_id) or 0) + 1
+                    statuses.append({
+                        'id': resource_id,
+                        'status': cls.STATUS_ERROR,
+                        'resolve_time': now,
+                        'next_resolve_time': now + cls.retry_interval(fail_count - 1),
+                        'fail_count': fail_count,
+                    })
+                    counters[resource_id] = (0, 0)
+                    continue
+
+                resource_ips = current[resource_id]
+                ips_to_add = resolved_ips - resource_ips.keys()
+                ips_to_delete = resource_ips.keys() - resolved_ips
+
+                # Resource resolved, but may have no RR or RRSets
+                statuses.append({
+                    'id': resource_id,
+                    'status': cls.STATUS_RESOLVED,
+                    'resolve_time': now,
+                    'next_resolve_time': now + cls.resolve_interval(ttls.get(resource_id)),
+                    'fail_count': 0,
+                    'ip_count': len(resolved_ips),
+                })
+
+                to_insert.extend({'resource_id': resource_id, 'ip': ip} for ip in ips_to_add)
+                to_delete.extend(resource_ips[ip] for ip in ips_to_delete)
+                counters[resource_id] = (len(ips_to_add), len(ips_to_delete))
+
+            for delete_start in range(0, len(to_delete), SYNC_BATCH_SIZE):
+                ids = to_delete[delete_start:delete_start + SYNC_BATCH_SIZE]
+                db.session.execute(delete(IP).where(IP.id.in_(ids)))
+
+            if to_insert:
+                db.session.execute(insert(IP), to_insert)
+
+            db.session.bulk_update_mappings(cls, statuses)
+            db.session.commit()
 
-        db.session.commit()
+        return counters
 
 
 class IP(db.Model):
     __tablename__ = 'ip'
+    # Unique index also serves lookups by resource_id alone
+    __table_args__ = (
+        db.Index('uq_ip_resource_ip', 'resource_id', 'ip', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    ip = db.Column(db.String, nullable=False)
+    ip = db.Column(db.String, nullable=False, index=True)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), nullable=False)
     resource = db.relationship('Resource')
 
     def __repr__(self):
         return f'<IP {self.ip}>'
+
+
+class IPVersion(db.Model):
+    """ One row, incremented by triggers on every change of the ip table """
+    __tablename__ = 'ip_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def current(cls) -> int:
+        return db.session.execute(select(cls.version)).scalar() or 0
+
+
+IP_VERSION_DDL = [
+    'INSERT OR IGNORE INTO ip_version (id, version) VALUES (1, 0)',
+    'CREATE TRIGGER IF NOT EXISTS ip_version_insert AFTER INSERT ON ip '
+    'BEGIN UPDATE ip_version SET version = version + 1; END',
+    'CREATE TRIGGER IF NOT EXISTS ip_version_delete AFTER DELETE ON ip '
+    'BEGIN UPDATE ip_version SET version = version + 1; END',
+    'CREATE TRIGGER IF NOT EXISTS ip_version_update AFTER UPDATE OF ip, resource_id ON ip '
+    'BEGIN UPDATE ip_version SET version = version + 1; END',
+]
+
+# Tables are created in order of dependencies, ip_version has none, so it exists before ip
+for ddl in IP_VERSION_DDL:
+    event.listen(IP.__table__, 'after_create', DDL(ddl))
+
+RESOURCE_FTS_DDL = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS resource_fts USING fts5('
+    'name, description, "order", content=resource, content_rowid=id, prefix=\'2 3\')',
+    'CREATE TRIGGER IF NOT EXISTS resource_fts_insert AFTER INSERT ON resource BEGIN '
+    'INSERT INTO resource_fts (rowid, name, description, "order") '
+    'VALUES (new.id, new.name, new.description, new."order"); END',
+    'CREATE TRIGGER IF NOT EXISTS resource_fts_delete AFTER DELETE ON resource BEGIN '
+    'INSERT INTO resource_fts (resource_fts, rowid, name, description, "order") '
+    'VALUES (\'delete\', old.id, old.name, old.description, old."order"); END',
+    # Only text fields, status and counters updated by every resolve do not touch the index
+    'CREATE TRIGGER IF NOT EXISTS resource_fts_update AFTER UPDATE OF name, description, "order" ON resource BEGIN '
+    'INSERT INTO resource_fts (resource_fts, rowid, name, description, "order") '
+    'VALUES (\'delete\', old.id, old.name, old.description, old."order"); '
+    'INSERT INTO resource_fts (rowid, name, description, "order") '
+    'VALUES (new.id, new.name, new.description, new."order"); END',
+]
+RESOURCE_FTS_REBUILD = "INSERT INTO resource_fts (resource_fts) VALUES ('rebuild')"
+
+for ddl in RESOURCE_FTS_DDL:
+    event.listen(Resource.__table__, 'after_create', DDL(ddl))
@@ -0,0 +1,165 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import func, or_, select
+
+from resolver import DNSConnectionError, resolve_stream
+from resolver.cache import DNSCache
+from webapp.models import db, Resource, RESOLVE_INTERVAL_MAX
+
+DEFAULT_RATE = 20
+DEFAULT_BATCH = 200
+# Longest sleep when nothing is due, so resources added meanwhile are not waiting for long
+DEFAULT_IDLE = 60
+
+
+@dataclass
+class SchedulerStats:
+    resolved: int = 0
+    failed: int = 0
+    added: int = 0
+    deleted: int = 0
+    batches: int = 0
+
+
+class ResolveScheduler:
+    """
+    Keeps resources resolved by picking the ones that are due: never resolved first, then by next_resolve_time.
+    Resolved resources are due after their DNS TTL, failed ones after exponential backoff (see Resource.sync_ips).
+    Resources are read from DB one batch at a time and resolved at no more than `rate` resources per second,
+    so DNS and DB get a steady low load instead of a burst over the whole table.
+    """
+
+    def __init__(
+            self,
+            cache: Optional[DNSCache] = None,
+            rate: float = DEFAULT_RATE,
+            batch_size: int = DEFAULT_BATCH,
+            concurrency: int = 50,
+            timeout: float = 5.0,
+            idle: float = DEFAULT_IDLE,
+    ):
+        self.cache = cache
+        self.rate = rate
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.idle = idle
+        self.stats = SchedulerStats()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def due(self, now: datetime) -> list:
+        """ (id, name) of resources due at now, the most overdue first """
+        rows = db.session.execute(
+            select(Resource.id, Resource.name)
+            .where(or_(Resource.next_resolve_time.is_(None), Resource.next_resolve_time <= now))
+            .order_by(Resource.next_resolve_time.asc().nullsfirst())
+            .limit(self.batch_size)
+        )
+        return rows.all()
+
+    def backlog(self, now: datetime) -> int:
+        return db.session.execute(
+            select(func.count(Resource.id))
+            .where(or_(Resource.next_resolve_time.is_(None), Resource.next_resolve_time <= now))
+        ).scalar()
+
+    def next_due(self) -> Optional[datetime]:
+        return db.session.execute(select(func.min(Resource.next_resolve_time))).scalar()
+
+    def resolve_batch(self, batch: list):
+        resolved = {}
+        ttls = {}
+        domains = {}
+
+        for resource_id, name in batch:
+            resource = Resource(name=name)
+            if resource.is_address():
+                resolved[resource_id] = resource.get_resolved_ips()
+                ttls[resource_id] = RESOLVE_INTERVAL_MAX
+            else:
+                domains[name] = resource_id
+
+        results = resolve_stream(domains, concurrency=self.concurrency, timeout=self.timeout, cache=self.cache)
+        for result in results:
+            resource_id = domains[result.domain]
+            if isinstance(result.error, DNSConnectionError):
+                resolved[resource_id] = None
+                self.stats.failed += 1
+                logger.debug(f'Failed to resolve {result.domain}')
+            else:
+                resolved[resource_id] = set(result.ips)
+                ttls[resource_id] = result.ttl
+
+        for added, deleted in Resource.sync_ips(resolved, ttls).values():
+            self.stats.added += added
+            self.stats.deleted += deleted
+        self.stats.resolved += len(batch)
+        self.stats.batches += 1
+
+    def fail_batch(self, batch: list):
+        """ Back off the whole batch after an unexpected error, so it does not stay at the head of the queue """
+        db.session.rollback()
+        Resource.sync_ips({resource_id: None for resource_id, name in batch})
+        self.stats.failed += len(batch)
+        self.stats.batches += 1
+
+    def run(self, budget: Optional[float] = None, once: bool = False) -> SchedulerStats:
+        """
+        Resolve due resources until stopped or budget seconds pass.
+        With once, returns as soon as nothing is due.
+        """
+        started = time.monotonic()
+        deadline = started + budget if budget else None
+
+        while not self._stop.is_set():
+            if deadline and time.monotonic() >= deadline:
+                logger.info(f'Run time budget {budget}s is over')
+                break
+
+            now = datetime.now()
+            batch = self.due(now)
+
+            if not batch:
+                if once:
+                    break
+                next_due = self.next_due()
+                wait = self.idle if next_due is None else (next_due - now).total_seconds()
+                wait = min(self.idle, max(wait, 1))
+                if deadline:
+                    wait = min(wait, max(0, deadline - time.monotonic()))
+                self._stop.wait(wait)
+                continue
+
+            batch_started = time.monotonic()
+            try:
+                self.resolve_batch(batch)
+            except Exception:
+                logger.exception(f'Failed to resolve batch of {len(batch)} resources, retrying them later')
+                try:
+                    self.fail_batch(batch)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Failed to mark the batch as failed')
+            else:
+                logger.info(
+                    f'Resolved {len(batch)} resources, {self.backlog(datetime.now())} due, total {self.stats}'
+                )
+
+            # Keep to the rate: a batch takes at least len(batch) / rate seconds
+            pause = len(batch) / self.rate - (time.monotonic() - batch_started)
+            if deadline:
+                pause = min(pause, deadline - time.monotonic())
+            if pause > 0:
+                self._stop.wait(pause)
+
+        if self.cache is not None:
+            self.cache.evict()
+        return self.stats
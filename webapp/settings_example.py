@@ -11,17 +11,63 @@ DEBUG = True
 
 PREFIX = '/og'
 
+# Resources per page of the list and the JSON API, ?limit= can ask for up to the max
+RESOURCES_PAGE_SIZE = 100
+RESOURCES_PAGE_MAX = 1000
+
 NB_URL = 'netbox-url'
 NB_API_TOKEN = 'netbox-token'
 NB_BRASS_ID = 5
 NB_CISCO = 3
+# Keep-alive connections to Netbox, GET retries on connection errors and 5xx,
+# fetch pages of big lists concurrently
+NB_POOL_SIZE = 10
+NB_RETRIES = 3
+NB_PARALLEL = True
 
 JUNIPER_ROUTERS = ['r1', 'r2']
+# Netbox devices are cached in memory, seconds
+INVENTORY_TTL = 300
+
+# Aggregate IPs into minimal list of prefixes before generating ACL/routes
+ACL_OPTIMIZE = False
+# Push only changed ACL entries/routes instead of rebuilding them
+CONFIG_INCREMENTAL = False
+# Lines per page of generated config preview, the whole config is downloaded as a file
+CONFIG_PREVIEW_LINES = 500
+# Device sessions are reused within idle TTL, seconds
+SESSION_IDLE_TTL = 300
+SESSION_MAX_PER_DEVICE = 1
+# Seconds to wait for a device session busy with another operation: background jobs and page requests
+SESSION_ACQUIRE_TIMEOUT = 600
+SESSION_ACQUIRE_TIMEOUT_VIEW = 10
+# Detected ACL names and last known ACL/routes of devices
+DEVICE_STATE_FILE = os.path.join(basedir, '', '../device_state.db')
+# Devices checked at once on the Config page
+DRIFT_WORKERS = 10
+# Last resolved IP set, rebuilt only after the ip table changes
+IP_SNAPSHOT_FILE = os.path.join(basedir, '', '../ip_snapshot.bin')
+# Device Diff/Generate/Config jobs running at once in background
+JOB_WORKERS = 4
 
 username = 'user'
 password = 'pass'
 
 SENTRY_DSN = 'SENTRY_DSN'
 
+RESOLVE_CONCURRENCY = 50
+RESOLVE_TIMEOUT = 5
+# resolve_resources.py: resources per second, resources read from DB at once,
+# run time in seconds before exit, 0 - run until stopped
+RESOLVE_RATE = 20
+RESOLVE_BATCH = 200
+RESOLVE_BUDGET = 0
+# Empty list means nameservers from /etc/resolv.conf
+DNS_NAMESERVERS = []
+# Initial and max queries per second to every nameserver
+DNS_RATE = 50
+DNS_MAX_RATE = 500
+DNS_CACHE_FILE = os.path.join(basedir, '', '../dns_cache.db')
+
 LOG_FILE = '/var/log/og.log'
 LOG_LEVEL = 'INFO'
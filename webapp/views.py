@@ -1,21 +1,80 @@
+import json
 import logging
+from datetime import date
+from functools import partial
+from itertools import islice
+from typing import Iterator
 
-from flask import render_template, url_for, request, flash, redirect, abort
+from flask import render_template, url_for, request, flash, redirect, abort, Response
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql import func, or_
+from sqlalchemy import select
 
 import configurator
 import netbox_client
+from configurator.inventory import Inventory
+from configurator.ipset import IPSet
+from configurator.snapshot import Snapshot, SnapshotStore
 from resolver import DNSConnectionError
 from webapp import app
-from webapp.forms import ResourceForm
-from webapp.models import db, Resource, IP
-from webapp.settings import PREFIX, NB_URL, NB_API_TOKEN, JUNIPER_ROUTERS, username, password
-
-
-@app.route(f'{PREFIX}/resources/', methods=['POST', 'GET'])
-def resources_view():
-    page_title = 'Resources'
+from webapp.drift import DriftSweeper
+from webapp.forms import ResourceForm, ResourceType
+from webapp.jobs import Job, JobRunner, JOB_DONE
+from webapp.models import db, Resource, IP, IPVersion
+from webapp.settings import (
+    PREFIX,
+    NB_URL,
+    NB_API_TOKEN,
+    NB_POOL_SIZE,
+    NB_RETRIES,
+    NB_PARALLEL,
+    JUNIPER_ROUTERS,
+    INVENTORY_TTL,
+    ACL_OPTIMIZE,
+    CONFIG_INCREMENTAL,
+    CONFIG_PREVIEW_LINES,
+    DRIFT_WORKERS,
+    JOB_WORKERS,
+    IP_SNAPSHOT_FILE,
+    SESSION_ACQUIRE_TIMEOUT_VIEW,
+    RESOURCES_PAGE_SIZE,
+    RESOURCES_PAGE_MAX,
+    username,
+    password,
+)
+
+drift_sweeper = DriftSweeper(workers=DRIFT_WORKERS)
+job_runner = JobRunner(workers=JOB_WORKERS)
+nb = netbox_client.NetboxClient(
+    NB_URL, NB_API_TOKEN, pool_size=NB_POOL_SIZE, retries=NB_RETRIES, parallel=NB_PARALLEL
+)
+inventory = Inventory(nb, JUNIPER_ROUTERS, ttl=INVENTORY_TTL)
+ip_snapshots = SnapshotStore(IP_SNAPSHOT_FILE)
+
+DEVICE_JOBS = ('diff', 'generate', 'config')
+
+# Seconds between keepalive comments in job event streams
+JOB_KEEPALIVE = 15
+
+
+def effective_ips() -> Snapshot:
+    """ All resolved IPs, read from DB only when the ip table has changed since the last call """
+    return ip_snapshots.get(IPVersion.current(), lambda: db.session.execute(select(IP.ip)).scalars())
+
+
+def resources_page(args) -> dict:
+    """
+    One page of resources ordered by name, filtered by search, type and added date from args.
+    Pages are addressed by name of the last row of the previous page (after) or the first row of the next one (before),
+    so any page is an index range scan however deep it is.
+    """
+    search_str = args.get('search', '').strip()
+    search_type = args.get('type', '')
+    # Invalid dates are ignored
+    added_from = args.get('added_from', type=date.fromisoformat)
+    added_to = args.get('added_to', type=date.fromisoformat)
+    limit = min(max(args.get('limit', RESOURCES_PAGE_SIZE, type=int), 1), RESOURCES_PAGE_MAX)
+    after = args.get('after')
+    before = args.get('before')
 
     resources = db.session.query(
         Resource.id,
@@ -26,11 +85,49 @@ def resources_view():
         Resource.added_date,
         Resource.resolve_time,
         Resource.description,
-        func.count(IP.resource_id)
-    ) \
-        .join(Resource.ips, isouter=True) \
-        .group_by(Resource.id) \
-        .order_by(Resource.name)
+        Resource.ip_count,
+    )
+
+    if search_str:
+        resources = resources.filter(Resource.matching(search_str))
+    if search_type:
+        resources = resources.filter(Resource.resource_type == search_type)
+    if added_from:
+        resources = resources.filter(Resource.added_date >= added_from)
+    if added_to:
+        resources = resources.filter(Resource.added_date <= added_to)
+
+    # One row more tells if there is a page further
+    if before is not None:
+        rows = resources.filter(Resource.name < before).order_by(Resource.name.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_prev, has_next = has_more, True
+    else:
+        if after is not None:
+            resources = resources.filter(Resource.name > after)
+        rows = resources.order_by(Resource.name).limit(limit + 1).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = after is not None
+
+    return {
+        'resources': rows,
+        'next': rows[-1].name if rows and has_next else None,
+        'prev': rows[0].name if rows and has_prev else None,
+        'filters': {
+            'search': search_str,
+            'type': search_type,
+            'added_from': added_from,
+            'added_to': added_to,
+            'limit': limit,
+        },
+    }
+
+
+@app.route(f'{PREFIX}/resources/', methods=['POST', 'GET'])
+def resources_view():
+    page_title = 'Resources'
 
     input_form = ResourceForm(obj=request.form)
 
@@ -67,21 +164,51 @@ def resources_view():
 
                 return redirect(back)
 
-    search_str = request.args.get('search')
-    search = f'%{search_str}%'
-    if search_str:
-        resources = resources.filter(
-            or_(
-                Resource.name.like(search),
-                Resource.description.like(search),
-                Resource.order.like(search),
-                Resource.added_date.like(search),
-                Resource.resource_type.like(search),
-                Resource.resolve_time.like(search),
-            )
-        )
-
-    return render_template('resources.html', form=input_form, resources=resources, page_title=page_title)
+    page = resources_page(request.args)
+    filters = page['filters']
+    # Filters of the page links, empty ones are left out
+    link_args = {key: value for key, value in filters.items() if value and key != 'limit'}
+    if filters['limit'] != RESOURCES_PAGE_SIZE:
+        link_args['limit'] = filters['limit']
+
+    return render_template(
+        'resources.html',
+        form=input_form,
+        resources=page['resources'],
+        next_page=page['next'],
+        prev_page=page['prev'],
+        link_args=link_args,
+        page_title=page_title,
+        search_str=filters['search'],
+        search_type=filters['type'],
+        added_from=filters['added_from'],
+        added_to=filters['added_to'],
+        resource_types=[resource_type.name for resource_type in ResourceType],
+    )
+
+
+@app.route(f'{PREFIX}/api/resources/')
+def resources_api_view():
+    """ The same pages as the resources list, next/prev are values for after/before arguments """
+    page = resources_page(request.args)
+    return {
+        'resources': [
+            {
+                'id': resource.id,
+                'name': resource.name,
+                'status': resource.status,
+                'resource_type': resource.resource_type,
+                'order': resource.order,
+                'added_date': resource.added_date.isoformat() if resource.added_date else None,
+                'resolve_time': resource.resolve_time.isoformat() if resource.resolve_time else None,
+                'description': resource.description,
+                'ip_count': resource.ip_count,
+            }
+            for resource in page['resources']
+        ],
+        'next': page['next'],
+        'prev': page['prev'],
+    }
 
 
 @app.route(f'{PREFIX}/resources/delete/<int:resource_id>', methods=['POST'])
@@ -155,15 +282,16 @@ def resource_view(resource_id):
     return render_template('resource.html', form=form, resource=resource)
 
 
-@app.route(f'{PREFIX}/config')
+@app.route(f'{PREFIX}/config', methods=['POST', 'GET'])
 def config_view():
     page_title = 'Config'
     back = url_for('resources_view')
 
-    nb = netbox_client.NetboxClient(NB_URL, NB_API_TOKEN)
     try:
-        cisco_hosts = configurator.get_cisco_hosts(nb)
-        juniper_hosts = configurator.get_juniper_hosts(nb, JUNIPER_ROUTERS)
+        if request.method == 'POST' and request.form.get('action') == 'refresh_inventory':
+            inventory.refresh()
+        cisco_hosts = inventory.cisco_hosts()
+        juniper_hosts = inventory.juniper_hosts()
     except configurator.NetboxConnectionError:
         flash('Netbox connection error', category='error')
         return redirect(back)
@@ -175,17 +303,41 @@ def config_view():
         logging.exception(e)
         return redirect(back)
 
-    return render_template('devices.html', page_title=page_title, cisco_hosts=cisco_hosts, juniper_hosts=juniper_hosts)
+    if request.method == 'POST':
+        action = request.form.get('action', None)
+
+        if action in ('check_drift', 'check_drift_cached'):
+            resolved_ips = effective_ips().ips
+
+            started = drift_sweeper.start(
+                hosts=cisco_hosts + juniper_hosts,
+                resolved_ips=resolved_ips,
+                username=username,
+                password=password,
+                optimize=ACL_OPTIMIZE,
+                use_cached=action == 'check_drift_cached',
+            )
+            if not started:
+                flash('Drift check is already running')
+
+        return redirect(url_for('config_view'))
+
+    return render_template(
+        'devices.html',
+        page_title=page_title,
+        cisco_hosts=cisco_hosts,
+        juniper_hosts=juniper_hosts,
+        drift=drift_sweeper.results(),
+        drift_sweeper=drift_sweeper,
+    )
 
 
 @app.route(f'{PREFIX}/devices/<hostname>/', methods=['POST', 'GET'])
 def device_view(hostname):
-    nb = netbox_client.NetboxClient(NB_URL, NB_API_TOKEN)
     back = url_for('device_view', hostname=hostname)
 
     try:
-        cisco_hosts = [host for host in configurator.get_cisco_hosts(nb)]
-        juniper_hosts = configurator.get_juniper_hosts(nb, JUNIPER_ROUTERS)
+        host = inventory.get(hostname)
     except configurator.NetboxConnectionError:
         flash('Netbox connection error', category='error')
         return redirect(back)
@@ -197,15 +349,6 @@ def device_view(hostname):
         logging.exception(e)
         return redirect(back)
 
-    allowed_hosts = juniper_hosts + cisco_hosts
-
-    host = None
-
-    for allowed_host in allowed_hosts:
-        if hostname == allowed_host.name:
-            host = allowed_host
-            break
-
     if not host:
         return abort(404)
 
@@ -213,90 +356,251 @@ def device_view(hostname):
         action = request.form.get('action', None)
         back = url_for('device_view', hostname=hostname)
 
-        if action == 'diff':
-            ips = IP.query.all()
-            resolved_ips = set(ip.ip for ip in ips)
+        if action == 'refresh_state':
+            configurator.device_state.invalidate(host.primary_ip.address.split('/')[0])
+            flash('Cached device state cleared', category='success')
+            return redirect(back)
 
-            vendor = host.device_type.manufacturer.name.lower()
+        if action in DEVICE_JOBS:
+            resolved_ips = effective_ips().ips
+
+            job, created = job_runner.submit(hostname, action, partial(device_job, action, host, resolved_ips))
+            if not created:
+                flash(f'{job.action.capitalize()} is already running on this device')
+            return redirect(url_for('device_job_view', hostname=hostname, job_id=job.id))
+
+    job = job_runner.active(hostname)
+    if job is not None and not job.finished:
+        return redirect(url_for('device_job_view', hostname=hostname, job_id=job.id))
+
+    return render_template(
+        'device.html',
+        host=host,
+        snapshot=effective_ips(),
+        config_hash=configurator.device_state.config_hash(host.primary_ip.address.split('/')[0]),
+    )
+
+
+def device_job(action: str, host, resolved_ips: IPSet, job: Job) -> dict:
+    """ Runs in JobRunner thread, without request and app context """
+    host_ip = host.primary_ip.address.split('/')[0]
+    vendor = host.device_type.manufacturer.name.lower()
+
+    if action == 'diff':
+        job.message('Reading device config')
+        return configurator.get_diff(
+            host=host_ip,
+            username=username,
+            password=password,
+            vendor=vendor,
+            resolved_ips=resolved_ips,
+            optimize=ACL_OPTIMIZE,
+        )
 
-            try:
-                diff = configurator.get_diff(
-                    host=host.primary_ip.address.split('/')[0],
-                    username=username,
-                    password=password,
-                    vendor=vendor,
-                    resolved_ips=resolved_ips,
-                )
-            except configurator.OGAuthenticationException:
-                flash('Authentication error', category='error')
-                return redirect(back)
-            except configurator.OGTimeoutException:
-                flash('Timeout error', category='error')
-                return redirect(back)
-            except Exception as e:
-                flash('Device error')
-                logging.exception(e)
-                return redirect(back)
+    if action == 'generate':
+        job.message('Generating config')
+        device_config = configurator.generate_config(
+            host=host_ip,
+            username=username,
+            password=password,
+            vendor=vendor,
+            ips=resolved_ips,
+            optimize=ACL_OPTIMIZE,
+        )
+        # Lines are generated again by preview and download
+        del device_config['config_lines']
+        return device_config
+
+    if action == 'config':
+        job.message('Connecting to device')
+
+        def progress(done: int, total: int):
+            if not job.total:
+                job.message(f'Pushing {total} lines')
+            job.progress(done, total)
+
+        device_config = configurator.configure(
+            host=host_ip,
+            username=username,
+            password=password,
+            vendor=vendor,
+            ips=resolved_ips,
+            optimize=ACL_OPTIMIZE,
+            incremental=CONFIG_INCREMENTAL,
+            progress=progress,
+        )
+        job.message(f'Finished: {device_config["status"].name}')
+        return device_config
 
-            return render_template('device.html', host=host, diff=diff)
 
-        if action == 'generate':
-            ips = IP.query.all()
-            resolved_ips = set(ip.ip for ip in ips)
-            resolved_ips = sorted(resolved_ips)
+def job_error_message(e: Exception) -> str:
+    if isinstance(e, configurator.OGAuthenticationException):
+        return 'Authentication error'
+    if isinstance(e, configurator.OGTimeoutException):
+        return 'Timeout error'
+    if isinstance(e, configurator.OGWriteTimeoutException):
+        return 'Timeout while save configuration. Check device'
+    return 'Device error'
 
-            vendor = host.device_type.manufacturer.name.lower()
 
-            try:
-                device_config = configurator.generate_config(
-                    host=host.primary_ip.address.split('/')[0],
-                    username=username,
-                    password=password,
-                    vendor=vendor,
-                    ips=resolved_ips,
-                )
-            except configurator.OGAuthenticationException:
-                flash('Authentication error', category='error')
-                return redirect(back)
-            except configurator.OGTimeoutException:
-                flash('Timeout error', category='error')
-                return redirect(back)
-            except Exception as e:
-                flash('Device error')
-                logging.exception(e)
-                return redirect(back)
+@app.route(f'{PREFIX}/devices/<hostname>/jobs/<job_id>/')
+def device_job_view(hostname, job_id):
+    job = job_runner.get(job_id)
+    if job is None or job.device != hostname:
+        flash('Job is not found, it may be too old')
+        return redirect(url_for('device_view', hostname=hostname))
 
-            return render_template('device.html', host=host, device_config=device_config)
+    try:
+        host = inventory.get(hostname)
+    except Exception as e:
+        flash('Netbox error')
+        logging.exception(e)
+        return redirect(url_for('config_view'))
 
-        if action == 'config':
-            ips = IP.query.all()
-            resolved_ips = set(ip.ip for ip in ips)
-            resolved_ips = sorted(resolved_ips)
+    if not host:
+        return abort(404)
 
-            vendor = host.device_type.manufacturer.name.lower()
+    results = {}
+    if job.status == JOB_DONE:
+        results = {
+            'diff': {'diff': job.result},
+            'generate': {'generated': job.result},
+            'config': {'device_config': job.result},
+        }[job.action]
+
+    return render_template(
+        'device.html',
+        host=host,
+        job=job,
+        job_error=job_error_message(job.error) if job.error else None,
+        **results,
+    )
+
+
+@app.route(f'{PREFIX}/jobs/<job_id>/events')
+def job_events_view(job_id):
+    """ Server-Sent Events: job progress, messages and status until it is finished """
+    job = job_runner.get(job_id)
+    if job is None:
+        return abort(404)
 
-            try:
-                device_config = configurator.configure(
-                    host=host.primary_ip.address.split('/')[0],
-                    username=username,
-                    password=password,
-                    vendor=vendor,
-                    ips=resolved_ips,
-                )
-            except configurator.OGAuthenticationException:
-                flash('Authentication error', category='error')
-                return redirect(back)
-            except configurator.OGTimeoutException:
-                flash('Timeout error', category='error')
-                return redirect(back)
-            except configurator.OGWriteTimeoutException:
-                flash('Timeout while save configuration. Check device', category='error')
-                return redirect(back)
-            except Exception as e:
-                flash('Device error')
-                logging.exception(e)
-                return redirect(back)
+    last_event = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def events(last: int):
+        while True:
+            new_events = job.wait_events(last, timeout=JOB_KEEPALIVE)
+            if not new_events:
+                if job.finished:
+                    return
+                yield ': keepalive\n\n'
+                continue
+
+            for seq, event, data in new_events:
+                yield f'id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+                last = seq
+
+            if job.finished and last == len(job.events):
+                return
+
+    return Response(
+        events(last_event),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def stream_lines(lines: Iterator[str], batch: int = 1000) -> Iterator[str]:
+    """ Config lines joined into chunks, so a big config is not written to the client line by line """
+    while True:
+        chunk = list(islice(lines, batch))
+        if not chunk:
+            return
+        yield '\n'.join(chunk) + '\n'
+
+
+def generate_device_config(host) -> dict:
+    return configurator.generate_config(
+        host=host.primary_ip.address.split('/')[0],
+        username=username,
+        password=password,
+        vendor=host.device_type.manufacturer.name.lower(),
+        ips=effective_ips().ips,
+        optimize=ACL_OPTIMIZE,
+        # Request is not held while the device is busy with a job or a sweep
+        acquire_timeout=SESSION_ACQUIRE_TIMEOUT_VIEW,
+    )
+
+
+@app.route(f'{PREFIX}/devices/<hostname>/config/')
+def device_config_view(hostname):
+    """ Generated config preview, one page of CONFIG_PREVIEW_LINES lines """
+    back = url_for('device_view', hostname=hostname)
+    page = request.args.get('page', 1, type=int)
+
+    try:
+        host = inventory.get(hostname)
+    except Exception as e:
+        flash('Netbox error')
+        logging.exception(e)
+        return redirect(url_for('config_view'))
+
+    if not host:
+        return abort(404)
+
+    try:
+        device_config = generate_device_config(host)
+    except configurator.OGAuthenticationException:
+        flash('Authentication error', category='error')
+        return redirect(back)
+    except configurator.OGTimeoutException:
+        flash('Timeout error', category='error')
+        return redirect(back)
+    except Exception as e:
+        flash('Device error')
+        logging.exception(e)
+        return redirect(back)
+
+    pages = max(1, -(-device_config['lines_count'] // CONFIG_PREVIEW_LINES))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * CONFIG_PREVIEW_LINES
+    device_config['config_lines'] = list(islice(device_config['config_lines'], start, start + CONFIG_PREVIEW_LINES))
+
+    return render_template('device.html', host=host, device_config=device_config, page=page, pages=pages)
+
+
+@app.route(f'{PREFIX}/devices/<hostname>/config.txt')
+def device_config_download(hostname):
+    back = url_for('device_view', hostname=hostname)
+
+    try:
+        host = inventory.get(hostname)
+    except Exception as e:
+        flash('Netbox error')
+        logging.exception(e)
+        return redirect(url_for('config_view'))
 
-            return render_template('device.html', host=host, device_config=device_config)
+    if not host:
+        return abort(404)
+
+    try:
+        device_config = generate_device_config(host)
+    except configurator.OGAuthenticationException:
+        flash('Authentication error', category='error')
+        return redirect(back)
+    except configurator.OGTimeoutException:
+        flash('Timeout error', category='error')
+        return redirect(back)
+    except Exception as e:
+        flash('Device error')
+        logging.exception(e)
+        return redirect(back)
+
+    if device_config['status'] == configurator.Status.NOACL:
+        flash('No OPENGARDEN ACL found for this device')
+        return redirect(back)
 
-    return render_template('device.html', host=host)
+    return Response(
+        stream_lines(device_config['config_lines']),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename={host.name}.txt'},
+    )